@@ -0,0 +1,371 @@
+# python benchmarks/benchmark.py --sizes 1000 10000 --baseline benchmarks/baseline.json
+
+# Each stage and size is run in a new process so that stages don't share caches or memory.
+# Wall time is the fastest of the repeats, excluding the setup and reset of each stage. Memory is the peak
+# resident memory of one further run of the stage in a forked process, less the memory resident when it starts,
+# so it includes memory outside the python allocators such as scratch files mapped into memory. Pages of
+# code and data shared with the parent count once touched, so small stages report a few megabytes.
+
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+import json
+import logging
+import multiprocessing
+import os
+from pathlib import Path
+import resource
+import sys
+import tempfile
+from time import perf_counter
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from clustering_dashboard import calculate, convert, group, summary, synthetic
+from clustering_dashboard.engine import engine
+
+SIZES = [1000, 10000, 100000, 1000000]
+COLUMNS = {'id': 'TripID', 'latitude': 'Latitude', 'longitude': 'Longitude', 'time': 'Pickup Time'}
+UNITS = {'distance': 'miles', 'time': 'minutes'}
+THRESHOLDS = {'distance': 0.25, 'time': 5}
+
+
+def records(size, seed=0, max_group=8):
+    '''Records with planted clusters for the thresholds.'''
+
+    df, _ = synthetic.generate(
+        size, seed, THRESHOLDS['distance'], UNITS['distance'], THRESHOLDS['time'], UNITS['time'], max_group=max_group
+    )
+
+    return df
+
+
+def dense_records(size, seed=0):
+    '''Uniform records at the density of 20000 records in a 2 mile square over 30 days, where most records
+    have many others within the distance threshold.'''
+
+    rng = np.random.default_rng(seed)
+    scale = size / 20000
+    half = convert.distance_to_radians(np.sqrt(scale), 'miles')
+    latitude = np.radians(40.75) + rng.uniform(-half, half, size)
+    longitude = np.radians(-73.98) + rng.uniform(-half, half, size) / np.cos(np.radians(40.75))
+    seconds = np.sort(rng.uniform(0, convert.time_to_seconds(30 * scale, 'days'), size))
+
+    df = pd.DataFrame({
+        COLUMNS['id']: np.arange(size),
+        COLUMNS['latitude']: np.degrees(latitude), COLUMNS['longitude']: np.degrees(longitude),
+        COLUMNS['time']: pd.Timestamp('2010-01-01') + pd.to_timedelta(seconds, unit='s')
+    })
+
+    return df
+
+
+def setup_records(size):
+
+    return {'df': records(size)}
+
+
+def setup_dense(size):
+
+    return {'df': dense_records(size)}
+
+
+def setup_graphs(size, max_group=8, dense=False):
+
+    df = dense_records(size) if dense else records(size, max_group=max_group)
+    max_radians = convert.distance_to_radians(THRESHOLDS['distance'], UNITS['distance'])
+    max_seconds = convert.time_to_seconds(THRESHOLDS['time'], UNITS['time'])
+
+    return {
+        'df': df,
+        'distance_radians': calculate.distance_graph(df, COLUMNS['latitude'], COLUMNS['longitude'], max_radians),
+        'duration_seconds': calculate.duration_graph(df, COLUMNS['time'], max_seconds)
+    }
+
+
+def setup_labels(size, max_group=8):
+
+    state = setup_graphs(size, max_group)
+    state['df'] = group.get_clusters(
+        state['df'], state['distance_radians'], UNITS['distance'], THRESHOLDS['distance'],
+        state['duration_seconds'], UNITS['time'], THRESHOLDS['time']
+    )
+    state['distance_tree'] = calculate.distance_tree(state['df'], COLUMNS['latitude'], COLUMNS['longitude'])
+    state['neighbors'] = calculate.nearest_neighbors(state['distance_tree'], engine.neighbor_count)
+    state['df'][['_latitude_mercator', '_longitude_mercator']] = np.column_stack(convert.latlon_to_mercator(
+        state['df'][COLUMNS['latitude']], state['df'][COLUMNS['longitude']]
+    ))
+
+    return state
+
+
+def setup_dashboard(size):
+
+    from clustering_dashboard.dashboard import dashboard
+
+    # python callbacks are only called directly here, not from the standalone output
+    logging.getLogger('bokeh').setLevel(logging.ERROR)
+
+    directory = Path(tempfile.mkdtemp())
+    records(size).to_parquet(directory / 'records.parquet')
+
+    db = dashboard(str(directory / 'dashboard.html'))
+    db._load_data(str(directory / 'records.parquet'))
+    for column, name in COLUMNS.items():
+        db.column_options[column].value = name
+    db._columns_confirmed(None)
+    db.units['distance'].value = UNITS['distance']
+    db.units['time'].value = UNITS['time']
+    db.parameters['cluster_distance'].value = THRESHOLDS['distance']
+    db.parameters['cluster_time'].value = THRESHOLDS['time']
+    db.reset_all()
+
+    # the cached result restores the clusters before each run
+    result = db.cluster_result(db.details, UNITS['distance'], THRESHOLDS['distance'], UNITS['time'], THRESHOLDS['time'])
+
+    return {'db': db, 'result': result}
+
+
+def reset_display(state):
+    '''Clusters as displayed after reclustering, without any selection.'''
+
+    state['db'].apply_result(state['result'])
+    state['db'].display_clusters()
+
+
+def reset_summary(state):
+    '''Clusters without any summary displayed, so the table is rebuilt.'''
+
+    state['db'].apply_result(state['result'])
+    state['db'].displayed_summary.clear()
+
+
+def reset_selection(state):
+    '''Clusters as displayed with the first location selected.'''
+
+    reset_display(state)
+    state['db'].source_location.selected.indices = [0]
+
+
+def select_location(state):
+
+    state['db'].source_location.selected.indices = [0]
+
+
+# setup, reset before each run, and run of each stage, along with the largest size the stage allows
+STAGES = {
+    'distance_matrix': (
+        setup_records, None,
+        lambda state: calculate.distance_matrix(state['df'], COLUMNS['latitude'], COLUMNS['longitude']),
+        10000
+    ),
+    'duration_matrix': (
+        setup_records, None,
+        lambda state: calculate.duration_matrix(state['df'], COLUMNS['time']),
+        10000
+    ),
+    'get_clusters': (
+        setup_graphs, None,
+        lambda state: group.get_clusters(
+            state['df'], state['distance_radians'], UNITS['distance'], THRESHOLDS['distance'],
+            state['duration_seconds'], UNITS['time'], THRESHOLDS['time'],
+            coordinate_columns=[COLUMNS['latitude'], COLUMNS['longitude']]
+        ),
+        None
+    ),
+    'get_clusters_dense': (
+        lambda size: setup_graphs(size, dense=True), None,
+        lambda state: group.get_clusters(
+            state['df'], state['distance_radians'], UNITS['distance'], THRESHOLDS['distance'],
+            state['duration_seconds'], UNITS['time'], THRESHOLDS['time'],
+            coordinate_columns=[COLUMNS['latitude'], COLUMNS['longitude']]
+        ),
+        None
+    ),
+    'get_linkage_dense': (
+        setup_dense, None,
+        lambda state: group.get_linkage(
+            state['df'], COLUMNS['latitude'], COLUMNS['longitude'], COLUMNS['time'],
+            convert.distance_to_radians(THRESHOLDS['distance'], UNITS['distance']) * engine.linkage_headroom,
+            convert.time_to_seconds(THRESHOLDS['time'], UNITS['time']) * engine.linkage_headroom,
+            convert.distance_to_radians(THRESHOLDS['distance'], UNITS['distance'])
+        ),
+        None
+    ),
+    'get_features': (
+        setup_labels, None,
+        lambda state: summary.get_features(
+            state['df'], state['distance_tree'], UNITS['distance'], state['df'][COLUMNS['time']], UNITS['time'],
+            neighbors=state['neighbors']
+        ),
+        None
+    ),
+    # groups of thousands of records, which skip the neighbor queries
+    'get_features_large_groups': (
+        lambda size: setup_labels(size, max_group=2000), None,
+        lambda state: summary.get_features(
+            state['df'], state['distance_tree'], UNITS['distance'], state['df'][COLUMNS['time']], UNITS['time'],
+            neighbors=state['neighbors']
+        ),
+        None
+    ),
+    'get_cluster_summary': (
+        setup_labels, None,
+        lambda state: summary.get_cluster_summary(
+            state['df'], state['distance_tree'], UNITS['distance'],
+            state['df'][COLUMNS['time']], UNITS['time'], COLUMNS['time']
+        ),
+        None
+    ),
+    'get_location_summary': (
+        setup_labels, None,
+        lambda state: summary.get_location_summary(state['df'], state['distance_tree'], UNITS['distance']),
+        None
+    ),
+    'get_time_summary': (
+        setup_labels, None,
+        lambda state: summary.get_time_summary(state['df'], state['df'][COLUMNS['time']], UNITS['time']),
+        None
+    ),
+    'update_summary': (
+        setup_dashboard, reset_summary,
+        lambda state: state['db'].update_summary(state['db'].cluster_summary, state['db'].source_summary, 'Cluster ID'),
+        None
+    ),
+    'table_row_selected': (
+        setup_dashboard, reset_display, select_location,
+        None
+    ),
+    'update_map': (
+        setup_dashboard, reset_selection,
+        lambda state: state['db'].update_map(),
+        None
+    )
+}
+
+
+def measure(stage, size, repeat):
+    '''Fastest wall time of a stage and the peak resident memory added while it runs.'''
+
+    setup, reset, run, _ = STAGES[stage]
+    state = setup(size)
+
+    # the forked process sends the memory resident when it starts, which its peak resident memory includes,
+    # and is forked before the repeats so that memory they free isn't reused without counting
+    if reset is not None:
+        reset(state)
+    read, write = os.pipe()
+    pid = os.fork()
+    if pid == 0:
+        os.write(write, str(_resident_bytes()).encode())
+        try:
+            run(state)
+        except BaseException:
+            os._exit(1)
+        os._exit(0)
+    os.close(write)
+    with os.fdopen(read) as pipe:
+        resident = int(pipe.read())
+    _, status = os.waitpid(pid, 0)
+    if status != 0:
+        raise RuntimeError(f'Stage {stage} failed measuring memory.')
+    # linux reports the peak resident memory of children in kilobytes
+    peak_bytes = max(resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss * 1024 - resident, 0)
+
+    seconds = []
+    for _ in range(repeat):
+        if reset is not None:
+            reset(state)
+        time_start = perf_counter()
+        run(state)
+        seconds += [perf_counter()-time_start]
+
+    return {'seconds': min(seconds), 'peak_bytes': peak_bytes}
+
+
+def _resident_bytes():
+    '''Resident memory of the process, from the pages reported by linux.'''
+
+    with open('/proc/self/statm') as statm:
+        pages = int(statm.read().split()[1])
+
+    return pages * os.sysconf('SC_PAGE_SIZE')
+
+
+def run_benchmarks(stages, sizes, repeat):
+
+    results = {}
+    context = multiprocessing.get_context('spawn')
+    for stage in stages:
+        results[stage] = {}
+        max_size = STAGES[stage][3]
+        for size in sizes:
+            if max_size is not None and size > max_size:
+                continue
+            with ProcessPoolExecutor(max_workers=1, mp_context=context) as executor:
+                results[stage][str(size)] = executor.submit(measure, stage, size, repeat).result()
+            print(f"{stage} {size} {results[stage][str(size)]['seconds']:.3f} seconds {results[stage][str(size)]['peak_bytes']/2**20:.1f} MB")
+
+    return results
+
+
+def regressions(results, baseline, tolerance, min_seconds=0.05, min_bytes=2**25):
+    '''Stages and sizes slower or larger than the baseline by more than the tolerance.
+
+    Increases below min_seconds or min_bytes aren't regressions, as small stages vary by more than the
+    tolerance between runs.
+    '''
+
+    floors = {'seconds': min_seconds, 'peak_bytes': min_bytes}
+    flagged = []
+    for stage, sizes in results.items():
+        for size, result in sizes.items():
+            if size not in baseline.get(stage, {}):
+                continue
+            for metric, floor in floors.items():
+                previous = baseline[stage][size][metric]
+                if result[metric] - previous > max(previous * tolerance, floor):
+                    ratio = result[metric] / max(previous, np.finfo(float).tiny)
+                    flagged += [{'stage': stage, 'size': int(size), 'metric': metric, 'ratio': ratio}]
+
+    return flagged
+
+
+def main(args=None):
+
+    parser = argparse.ArgumentParser(description='Wall time and peak memory of each stage at increasing sizes.')
+    parser.add_argument('--stages', nargs='*', default=list(STAGES.keys()), choices=list(STAGES.keys()))
+    parser.add_argument('--sizes', nargs='*', type=int, default=SIZES)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--output', default=None, help='json file for the results')
+    parser.add_argument('--baseline', default=None, help='json file of previous results to compare against')
+    parser.add_argument('--save-baseline', action='store_true', help='write the results as the baseline')
+    parser.add_argument('--tolerance', type=float, default=0.25, help='fraction above the baseline flagged as a regression')
+    parser.add_argument('--min-seconds', type=float, default=0.05, help='smallest increase in seconds flagged as a regression')
+    parser.add_argument('--min-bytes', type=int, default=2**25, help='smallest increase in peak bytes flagged as a regression')
+    args = parser.parse_args(args)
+
+    results = run_benchmarks(args.stages, args.sizes, args.repeat)
+
+    if args.output is not None:
+        Path(args.output).write_text(json.dumps(results, indent=2))
+
+    flagged = []
+    if args.baseline is not None:
+        baseline_path = Path(args.baseline)
+        if args.save_baseline:
+            baseline_path.write_text(json.dumps(results, indent=2))
+        elif baseline_path.exists():
+            flagged = regressions(
+                results, json.loads(baseline_path.read_text()), args.tolerance, args.min_seconds, args.min_bytes
+            )
+            for regression in flagged:
+                print(f"REGRESSION {regression['stage']} {regression['size']} {regression['metric']} {regression['ratio']:.2f}x baseline")
+
+    return 1 if flagged else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -7,6 +7,13 @@ def UniqueCountNonNA(series):
 
     return count
 
+def UniqueCountAssigned(series):
+
+    count = series[series>=0]
+    count = count.nunique()
+
+    return count
+
 def CountNA(series):
 
     count = series[series.isna()]
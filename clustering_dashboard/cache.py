@@ -0,0 +1,80 @@
+from collections import OrderedDict
+import sys
+
+import numpy as np
+import pandas as pd
+from scipy import sparse
+
+
+class result_cache():
+    '''Least recently used results, evicted once their combined size exceeds a memory cap.'''
+
+    def __init__(self, max_bytes):
+
+        self.max_bytes = max_bytes
+        self.nbytes = 0
+        self.entries = OrderedDict()
+
+
+    def get(self, key):
+
+        if key not in self.entries:
+            return None
+        self.entries.move_to_end(key)
+
+        return self.entries[key][0]
+
+
+    def put(self, key, value):
+
+        if key in self.entries:
+            self.nbytes -= self.entries.pop(key)[1]
+
+        nbytes = result_bytes(value)
+        if nbytes > self.max_bytes:
+            return
+        self.entries[key] = (value, nbytes)
+        self.nbytes += nbytes
+
+        while self.nbytes > self.max_bytes:
+            _, (_, evicted) = self.entries.popitem(last=False)
+            self.nbytes -= evicted
+
+
+    def clear(self):
+
+        self.entries.clear()
+        self.nbytes = 0
+
+
+def result_bytes(value):
+    '''Approximate memory of arrays, sparse matrices and frames nested in a dictionary, including nested lists of objects.'''
+
+    if isinstance(value, dict):
+        nbytes = sum(result_bytes(item) for item in value.values())
+    elif isinstance(value, (pd.DataFrame, pd.Series)):
+        nbytes = int(np.sum(value.memory_usage(deep=True)))
+        # deep memory usage only counts the outer list of each value
+        frame = value.to_frame() if isinstance(value, pd.Series) else value
+        for _, column in frame.loc[:, frame.dtypes==object].items():
+            nbytes += sum(_nested_bytes(item) for item in column)
+    elif isinstance(value, np.ndarray):
+        nbytes = int(value.nbytes)
+        if value.dtype == object:
+            nbytes += sum(sys.getsizeof(item) + _nested_bytes(item) for item in value.ravel())
+    elif sparse.issparse(value):
+        value = value.tocsr()
+        nbytes = int(value.data.nbytes + value.indices.nbytes + value.indptr.nbytes)
+    else:
+        nbytes = 0
+
+    return nbytes
+
+
+def _nested_bytes(item):
+    '''Memory of the items within a list or tuple, excluding the list itself.'''
+
+    if not isinstance(item, (list, tuple)):
+        return 0
+
+    return sum(sys.getsizeof(nested) + _nested_bytes(nested) for nested in item)
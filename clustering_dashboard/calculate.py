@@ -1,31 +1,156 @@
+import tempfile
+
 import numpy as np
 import numpy.ma as ma
 import pandas as pd
+from scipy import sparse
 from sklearn.metrics.pairwise import haversine_distances
 from sklearn.metrics import pairwise_distances
+from sklearn.neighbors import BallTree, KDTree
 
 from clustering_dashboard import convert, performance
 
-# TODO: calculate sparse distance_radians and duration matrix for better performance
-# https://stackoverflow.com/questions/35296935/python-calculate-lots-of-distances-quickly
+
+# default bytes of memory for each block of a blocked matrix
+MEMORY_BUDGET = 2**28
 
 
 @performance.timing
-def distance_matrix(df, column_latitude, column_longitude):
+def distance_matrix(df, column_latitude, column_longitude, memory_budget=None):
     
     coords = np.radians(df[[column_latitude, column_longitude]].values)
-    distance_radians = haversine_distances(coords, coords)
-    distance_radians = ma.array(distance_radians)
+    if memory_budget is None:
+        distance_radians = haversine_distances(coords, coords)
+        distance_radians = ma.array(distance_radians)
+    else:
+        distance_radians = blocked_matrix(haversine_distances, coords, memory_budget)
 
     return distance_radians
 
 
 @performance.timing
-def duration_matrix(df, column_time):
+def distance_tree(df, column_latitude, column_longitude):
+    '''Spatial index of the points in radians for haversine neighbor queries.'''
+
+    coords = np.radians(df[[column_latitude, column_longitude]].values)
+    tree = BallTree(coords, metric='haversine')
+
+    return tree
+
+
+@performance.timing
+def nearest_neighbors(distance_tree, count):
+    '''Distance in radians and position of the nearest records to each record, itself included, nearest first.
+
+    Neighbors don't depend on the thresholds so are found once, from a tree of unit vectors that is
+    kept for queries of more neighbors.
+    '''
+
+    coords = np.asarray(distance_tree.data)
+    unit = convert.radians_to_unit(coords)
+    tree = KDTree(unit)
+    chord, neighbor = tree.query(unit, k=min(count, len(coords)))
+
+    neighbors = {
+        'distance': convert.chord_to_radians(chord), 'neighbor': neighbor.astype('int32'),
+        'tree': tree, 'unit': unit
+    }
+
+    return neighbors
+
+
+@performance.timing
+def distance_graph(df, column_latitude, column_longitude, max_radians):
+    '''Sparse distance in radians between all pairs of points within max_radians of each other.'''
+
+    tree = distance_tree(df, column_latitude, column_longitude)
+    coords = np.asarray(tree.data)
+    neighbors, distances = tree.query_radius(coords, r=max_radians, return_distance=True, sort_results=True)
+
+    # explicit zeros are kept for duplicate coordinates as they are still within max_radians
+    indptr = np.concatenate([[0], np.cumsum([len(n) for n in neighbors])])
+    distance_radians = sparse.csr_matrix(
+        (np.concatenate(distances), np.concatenate(neighbors), indptr),
+        shape=(len(coords), len(coords))
+    )
+
+    return distance_radians
+
+
+def pair_radians(coords_first, coords_second):
+    '''Haversine distance in radians between each pair of latitude and longitude radians.'''
+
+    latitude = coords_second[:, 0] - coords_first[:, 0]
+    longitude = coords_second[:, 1] - coords_first[:, 1]
+    distance = np.sin(latitude/2)**2 + np.cos(coords_first[:, 0]) * np.cos(coords_second[:, 0]) * np.sin(longitude/2)**2
+    distance = 2 * np.arcsin(np.sqrt(distance))
+
+    return distance
+
+
+@performance.timing
+def duration_matrix(df, column_time, memory_budget=None):
 
     time = df[column_time].view('int64').to_numpy().reshape(-1,1)
-    duration_seconds = pairwise_distances(time, metric='cityblock') / 10**9
-    duration_seconds = ma.array(duration_seconds)
+    if memory_budget is None:
+        duration_seconds = pairwise_distances(time, metric='cityblock') / 10**9
+        duration_seconds = ma.array(duration_seconds)
+    else:
+        duration_seconds = blocked_matrix(
+            lambda first, second: pairwise_distances(first, second, metric='cityblock') / 10**9,
+            time, memory_budget
+        )
+
+    return duration_seconds
+
+
+def blocked_matrix(function, values, memory_budget):
+    '''Compute a pairwise matrix in blocks of rows written to a scratch memory mapped file of single precision.'''
+
+    size = len(values)
+    scratch = tempfile.TemporaryFile()
+    matrix = np.memmap(scratch, dtype='float32', mode='w+', shape=(size, size))
+
+    rows = block_rows(size, memory_budget)
+    for start in range(0, size, rows):
+        matrix[start:start+rows] = function(values[start:start+rows], values)
+    matrix.flush()
+
+    return matrix
+
+
+def block_rows(size, memory_budget=None):
+    '''Number of rows of a blocked matrix within the memory budget, allowing for temporary copies.'''
+
+    if memory_budget is None:
+        memory_budget = MEMORY_BUDGET
+
+    rows = max(memory_budget // (max(size, 1) * 8 * 4), 1)
+
+    return rows
+
+
+@performance.timing
+def duration_graph(df, column_time, max_seconds):
+    '''Sparse banded duration in seconds between all pairs of time sorted records within max_seconds.'''
+
+    if not df[column_time].is_monotonic_increasing:
+        raise RuntimeError('Records must be sorted by time.')
+
+    time = df[column_time].view('int64').to_numpy()
+    max_nanoseconds = max_seconds * 10**9
+
+    # records within max_seconds form a contiguous band around each sorted record
+    start = np.searchsorted(time, time - max_nanoseconds, side='left')
+    end = np.searchsorted(time, time + max_nanoseconds, side='right')
+    count = end - start
+    indptr = np.concatenate([[0], np.cumsum(count)])
+    indices = np.arange(indptr[-1]) - np.repeat(indptr[:-1] - start, count)
+
+    duration_seconds = sparse.csr_matrix(
+        (np.abs(time[indices] - np.repeat(time, count)) / 10**9, indices, indptr),
+        shape=(len(time), len(time))
+    )
 
     return duration_seconds
 
@@ -33,11 +158,16 @@ def duration_matrix(df, column_time):
 @performance.timing
 def nearest_point(distance_radians, units):
 
-    distance_radians.mask = np.eye(distance_radians.shape[0], dtype=bool)
-    np.fill_diagonal(distance_radians.mask, True)
-    nearest = distance_radians.min(axis=0)
+    if isinstance(distance_radians, BallTree):
+        # the closest of two neighbors is the point itself, or a duplicate at zero distance
+        nearest, _ = distance_radians.query(np.asarray(distance_radians.data), k=2)
+        nearest = nearest[:, 1]
+    else:
+        distance_radians.mask = np.eye(distance_radians.shape[0], dtype=bool)
+        np.fill_diagonal(distance_radians.mask, True)
+        nearest = distance_radians.min(axis=0)
+        distance_radians.mask = False
     nearest = convert.radians_to_distance(nearest, units)
-    distance_radians.mask = False
 
     nearest = pd.Series(np.array(nearest))
 
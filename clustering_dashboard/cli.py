@@ -0,0 +1,53 @@
+# python -m clustering_dashboard.cli records.parquet output --id TripID --latitude Latitude --longitude Longitude --time "Pickup Time"
+
+import argparse
+
+from clustering_dashboard.engine import engine
+from clustering_dashboard import performance
+
+
+def parse_args(args=None):
+
+    parser = argparse.ArgumentParser(
+        prog='python -m clustering_dashboard.cli',
+        description='Label records for the same location, time, and location and time without the dashboard.'
+    )
+    parser.add_argument('input', help='parquet file of records')
+    parser.add_argument('output', help='directory for the labeled details and summaries')
+    parser.add_argument('--id', required=True, help='column of the record id')
+    parser.add_argument('--latitude', required=True, help='column of the latitude in degrees')
+    parser.add_argument('--longitude', required=True, help='column of the longitude in degrees')
+    parser.add_argument('--time', required=True, help='column of the record time')
+    parser.add_argument('--detail-columns', nargs='*', default=None, help='other columns to keep, all by default')
+    parser.add_argument('--distance-units', default='miles', choices=['miles', 'feet', 'kilometers'])
+    parser.add_argument('--distance-threshold', type=float, required=True)
+    parser.add_argument('--time-units', default='minutes', choices=['days', 'hours', 'minutes'])
+    parser.add_argument('--time-threshold', type=float, required=True)
+    parser.add_argument('--workers', type=int, default=None, help='processes for labeling clusters')
+    parser.add_argument('--tiled', action='store_true', help='label locations from tiles of the coordinates, across the workers')
+    parser.add_argument('--memory-budget', type=int, default=None, help='bytes of each block of full pairwise matrices written to scratch files, in place of sparse graphs')
+    parser.add_argument('--metrics', default=None, help='json file for the duration, rows and bytes of each stage')
+
+    return parser.parse_args(args)
+
+
+def main(args=None):
+
+    args = parse_args(args)
+
+    model = engine()
+    model.load_details(args.input, {
+        'id': args.id, 'latitude': args.latitude, 'longitude': args.longitude, 'time': args.time
+    }, args.detail_columns)
+    model.cluster(
+        args.distance_units, args.distance_threshold, args.time_units, args.time_threshold,
+        workers=args.workers, linkage=False, memory_budget=args.memory_budget, tiled=args.tiled
+    )
+    model.write_results(args.output, args.distance_units, args.time_units)
+
+    if args.metrics is not None:
+        performance.metrics.to_json(args.metrics)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,27 +1,37 @@
 import base64
-import io
-
-import pandas as pd
+from tempfile import SpooledTemporaryFile
 
 from clustering_dashboard.figures import figures
-from clustering_dashboard import convert, calculate
+from clustering_dashboard import ingest
 
 
 class configuration(figures):
 
+    # base64 characters decoded at a time, a multiple of 4
+    upload_chunk = 2**22
+    # bytes of an upload kept in memory before spilling to disk
+    upload_memory = 2**26
+    source = None
+
     def __init__(self):
 
         pass
 
-    def _load_data(self, buffer_or_path):
+    def _load_data(self, buffer_or_path, source_format=None):
 
-        self.details = pd.read_parquet(buffer_or_path)
+        # only read the column names until the columns are selected
+        if source_format is None:
+            source_format = ingest.file_format(buffer_or_path)
+        if buffer_or_path is not self.source:
+            self._close_source()
+        self.source = buffer_or_path
+        self.source_format = source_format
+        names = ingest.read_schema(buffer_or_path, source_format)
 
-        dropdown = ['']+list(self.details.columns)
-        if self.details.index.name is not None:
-            dropdown += [self.details.index.name]
+        dropdown = ['']+names
         for col in self.column_options.values():
             col.options = dropdown
+        self.detail_options.options = names
 
         # TODO: allow creation of id column
         # self.column_options.menu['id'] += [None]
@@ -29,52 +39,56 @@ class configuration(figures):
 
     def _file_selected(self, attr, old, new):
 
-        decoded = base64.b64decode(new)
-        buffer = io.BytesIO(decoded)
+        self._close_source()
 
-        self._load_data(buffer)
+        # the file name may not be sent until after the contents, so the format is read from the contents
+        buffer = self._decode_upload(new)
+        self._load_data(buffer, ingest.buffer_format(buffer))
 
 
-    def _columns_selected(self, attr, old, new):
+    def _decode_upload(self, payload):
+        '''Decode a base64 upload in chunks to a file that spills to disk when large.'''
+
+        buffer = SpooledTemporaryFile(max_size=self.upload_memory)
+        for start in range(0, len(payload), self.upload_chunk):
+            buffer.write(base64.b64decode(payload[start:start+self.upload_chunk]))
+        buffer.seek(0)
+
+        return buffer
 
-        for col in self.column_options.keys():
-            self.columns.at[col] = self.column_options[col].value
 
+    def _close_source(self):
+        '''Close a previous upload, which may have spilled to disk.'''
 
-        if (self.columns.str.len()>0).all():
+        if isinstance(self.source, SpooledTemporaryFile):
+            self.source.close()
+        self.source = None
 
-            self._prepare_details()
 
-            figures.__init__(self)
+    def _session_destroyed(self, session_context):
 
-            self.generate_dashboard()
-            self.landing_page()
+        self._close_source()
+        figures._session_destroyed(self, session_context)
+
+
+    def _columns_selected(self, attr, old, new):
+
+        for col in self.column_options.keys():
+            self.columns.at[col] = self.column_options[col].value
 
-            if self.document is not None:
-                self.document.remove_root(self.layout_parameters)
-                self.document.add_root(self.layout_dashboard)
+        self.load_columns.disabled = not (self.columns.str.len()>0).all()
 
 
-    def _prepare_details(self):
+    def _columns_confirmed(self, event):
 
-        self.details[['Cluster ID', 'Location ID', 'Time ID']] = None
+        self.load_details(self.source, self.columns, self.detail_options.value, self.source_format)
 
-        self.details[self.columns['time']] = pd.to_datetime(self.details[self.columns['time']])
-        self.details = self.details.sort_values(by=self.columns['time'])
-        if self.details.index.name == self.columns['id']:
-            self.details = self.details.reset_index()
+        figures.__init__(self)
 
-        # pre-calculate comparison of location and time
-        self.distance_radians = calculate.distance_matrix(self.details, self.columns['latitude'], self.columns['longitude'])
-        self.duration_seconds = calculate.duration_matrix(self.details, self.columns['time'])
+        self.generate_dashboard()
+        self.landing_page()
 
-        # convert timestamp to integer for color bar heatmap
-        self.details['_timestamp'] = self.details[self.columns['time']].apply(lambda x: int(x.timestamp()*1000))
+        if self.document is not None:
+            self.document.remove_root(self.layout_parameters)
+            self.document.add_root(self.layout_dashboard)
 
-        # convert fo mercator for map display
-        latitude_mercator, longitude_mercator = convert.latlon_to_mercator(
-            self.details[self.columns['latitude']],
-            self.details[self.columns['longitude']]
-        )
-        self.details['_latitude_mercator'] = latitude_mercator
-        self.details['_longitude_mercator'] = longitude_mercator
\ No newline at end of file
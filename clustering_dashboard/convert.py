@@ -8,6 +8,8 @@ def duration_to_numeric(dur, time_units):
         dur = dur.dt.total_seconds()/60/60
     elif time_units == 'minutes':
         dur = dur.dt.total_seconds()/60
+    elif time_units == 'seconds':
+        dur = dur.dt.total_seconds()
     else:
         raise RuntimeError('Invalid time units.')
 
@@ -48,12 +50,14 @@ def seconds_to_time(seconds, time_units):
 
 def radians_to_distance(rads, distance_units):
 
-    if distance_units == 'miles':
-        dist = rads * 3958
+    if distance_units == 'radians':
+        dist = rads
+    elif distance_units == 'miles':
+        dist = rads * 3958.8
     elif distance_units == 'feet':
-        dist = rads * 3958 * 5280
+        dist = rads * 3958.8 * 5280
     elif distance_units == 'kilometers':
-        dist = dist * 6371
+        dist = rads * 6371
     else:
         raise RuntimeError('Invalid distance_radians units.')
 
@@ -62,7 +66,9 @@ def radians_to_distance(rads, distance_units):
 
 def distance_to_radians(dist, distance_units):
 
-    if distance_units == 'miles':
+    if distance_units == 'radians':
+        rads = dist
+    elif distance_units == 'miles':
         rads = dist / 3958.8
     elif distance_units == 'feet':
         rads = dist / 3958.8 / 5280
@@ -80,4 +86,25 @@ def latlon_to_mercator(latitude, longitude):
     longitude_mercator = longitude * (k * np.pi/180.0)
     latitude_mercator = np.log(np.tan((90 + latitude) * np.pi/360.0)) * k
 
-    return latitude_mercator, longitude_mercator
\ No newline at end of file
+    return latitude_mercator, longitude_mercator
+
+def radians_to_unit(coords):
+    '''Unit vectors of latitude and longitude in radians.
+
+    The chord between vectors increases with the haversine distance, so euclidean queries of unit vectors,
+    which are faster than haversine queries, find neighbors in the same order.
+    '''
+
+    latitude, longitude = coords[:, 0], coords[:, 1]
+    unit = np.column_stack([
+        np.cos(latitude) * np.cos(longitude), np.cos(latitude) * np.sin(longitude), np.sin(latitude)
+    ])
+
+    return unit
+
+
+def chord_to_radians(chord):
+
+    rads = 2 * np.arcsin(np.minimum(chord / 2, 1))
+
+    return rads
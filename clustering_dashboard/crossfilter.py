@@ -0,0 +1,56 @@
+import numpy as np
+from scipy import sparse
+
+from clustering_dashboard import performance
+
+ID_COLUMNS = ['Location ID', 'Time ID', 'Cluster ID']
+
+
+@performance.timing
+def id_index(details):
+    '''Rows of each Location, Time and Cluster ID, and the ids of the other columns sharing a row.
+
+    Each is a sparse matrix with a row per id, so a lookup only reads the stored columns of the selected ids.
+    '''
+
+    size = len(details)
+
+    rows = {}
+    for column in ID_COLUMNS:
+        labels = details[column].to_numpy()
+        assigned = np.flatnonzero(labels>=0)
+        rows[column] = sparse.csr_matrix(
+            (np.ones(len(assigned), dtype=bool), (labels[assigned], assigned)),
+            shape=(labels.max()+1 if len(assigned)>0 else 0, size)
+        )
+
+    # ids sharing at least one row
+    shared = {
+        (first, second): (rows[first] @ rows[second].T).tocsr()
+        for first in ID_COLUMNS for second in ID_COLUMNS if first != second
+    }
+
+    index = {'rows': rows, 'shared': shared}
+
+    return index
+
+
+def id_rows(index, column, ids):
+    '''Sorted positions of the records with any of the ids.'''
+
+    return _lookup(index['rows'][column], ids)
+
+
+def shared_ids(index, column, ids, other):
+    '''Sorted ids of another column for the records with any of the ids.'''
+
+    return _lookup(index['shared'][(column, other)], ids)
+
+
+def _lookup(matrix, ids):
+
+    ids = np.asarray(ids, dtype='int64')
+    if len(ids)==0:
+        return np.array([], dtype=matrix.indices.dtype)
+
+    return np.unique(matrix[ids].indices)
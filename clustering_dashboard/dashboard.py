@@ -21,6 +21,8 @@ class dashboard(layouts):
 
         if filepath is None:
             self.document.add_root(self.layout_parameters)
+            # release any upload and the clustering thread once the browser session ends
+            self.document.on_session_destroyed(self._session_destroyed)
         else:
             directory = Path(filepath).parents[0]
             Path(directory).mkdir(parents=True, exist_ok=True)
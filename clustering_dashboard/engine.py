@@ -0,0 +1,239 @@
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from clustering_dashboard import calculate, group, summary, convert, ingest, performance, cache, crossfilter
+
+class engine():
+
+    # multiple of the current thresholds the time gaps and cluster edges of the linkage are precomputed for
+    linkage_headroom = 2
+    # float32 halves the memory of the map coordinates
+    mercator_dtype = np.float64
+    # memory cap of the results cached for each dataset
+    cache_bytes = 2**28
+    # nearest records to each record found once for the nearest cluster features
+    neighbor_count = 8
+
+    def load_details(self, buffer_or_path, columns, detail_columns=None, source_format=None):
+        '''Read and prepare records for clustering, along with the mapping of id, latitude, longitude and time to column names.
+
+        With detail_columns, only the mapped columns and those detail columns are read. The format
+        defaults to the extension of a path, or parquet for a buffer. Records are sorted by time and
+        indexed once, so they can be clustered directly.
+        '''
+
+        self.columns = pd.Series(columns)[['id', 'latitude', 'longitude', 'time']]
+
+        if source_format is None:
+            if isinstance(buffer_or_path, (str, Path)):
+                source_format = ingest.file_format(buffer_or_path)
+            else:
+                source_format = 'parquet'
+
+        if detail_columns is None:
+            projection = None
+        else:
+            projection = list(dict.fromkeys(list(self.columns)+list(detail_columns)))
+
+        self.details = ingest.read_records(buffer_or_path, source_format, projection, self.columns['time'])
+        self._prepare_details()
+
+
+    @performance.timing
+    def _prepare_details(self):
+
+        time = self.columns['time']
+
+        if not pd.api.types.is_datetime64_any_dtype(self.details[time]):
+            self.details[time] = pd.to_datetime(self.details[time])
+        if not self.details[time].is_monotonic_increasing:
+            self.details = self.details.sort_values(by=time, kind='stable')
+        if self.details.index.name == self.columns['id']:
+            self.details = self.details.reset_index()
+
+        # ids are -1 until records are clustered
+        self.details[['Cluster ID', 'Location ID', 'Time ID']] = pd.DataFrame(
+            -1, index=self.details.index, columns=['Cluster ID', 'Location ID', 'Time ID'], dtype='int32'
+        )
+
+        # pre-calculate spatial index and reset the linkage of location and time
+        self.distance_tree = calculate.distance_tree(self.details, self.columns['latitude'], self.columns['longitude'])
+        self.neighbors = calculate.nearest_neighbors(self.distance_tree, self.neighbor_count)
+        self.linkage = None
+        self.id_index = None
+        self.results = cache.result_cache(self.cache_bytes)
+
+        # convert timestamp to integer milliseconds, truncated toward zero, for color bar heatmap
+        nanoseconds = self.details[time].values.view('int64')
+        self.details['_timestamp'] = np.sign(nanoseconds)*(np.abs(nanoseconds)//10**6)
+
+        # convert fo mercator for map display
+        latitude_mercator, longitude_mercator = convert.latlon_to_mercator(
+            self.details[self.columns['latitude']].to_numpy(),
+            self.details[self.columns['longitude']].to_numpy()
+        )
+        self.details['_latitude_mercator'] = latitude_mercator.astype(self.mercator_dtype, copy=False)
+        self.details['_longitude_mercator'] = longitude_mercator.astype(self.mercator_dtype, copy=False)
+
+
+    def cluster(self, distance_units, distance_threshold, time_units, time_threshold, workers=None, linkage=True, memory_budget=None, tiled=False):
+        '''Label the details and summarize each Location, Time and Cluster ID in radians and seconds.'''
+
+        result = self.cluster_result(
+            self.details, distance_units, distance_threshold, time_units, time_threshold, workers, linkage, memory_budget, tiled
+        )
+        self.apply_result(result)
+
+
+    @performance.timing
+    def cluster_result(self, details, distance_units, distance_threshold, time_units, time_threshold, workers=None, linkage=True, memory_budget=None, tiled=False):
+        '''Ids, features, summaries and an index of the ids for thresholds, without modifying the details so it can run in another thread.
+
+        With linkage, the linkage is kept so later thresholds only require relabeling. Otherwise the
+        records are labeled once from sparse graphs of the thresholds, optionally in a process pool.
+        A memory budget instead labels from full distance and duration matrices, computed in blocks
+        within the budget and written to scratch files. Without linkage, tiled labels Location ID from
+        tiles of the coordinates in the process pool. Results are cached so that revisiting thresholds
+        doesn't recalculate.
+        '''
+
+        max_radians = convert.distance_to_radians(distance_threshold, distance_units)
+        max_seconds = convert.time_to_seconds(time_threshold, time_units)
+
+        # the same thresholds in other units can differ by rounding
+        key = (float(f'{max_radians:.12g}'), float(f'{max_seconds:.12g}'))
+        result = self.results.get(key)
+        if result is not None:
+            return result
+
+        # new columns are only added to the copy
+        details = details.copy(deep=False)
+
+        coordinate_columns = [self.columns['latitude'], self.columns['longitude']]
+
+        if memory_budget is not None:
+            distance_radians = calculate.distance_matrix(
+                details, self.columns['latitude'], self.columns['longitude'], memory_budget
+            )
+            duration_seconds = calculate.duration_matrix(details, self.columns['time'], memory_budget)
+            details = group.get_clusters(
+                details, distance_radians, 'radians', max_radians,
+                duration_seconds, 'seconds', max_seconds, workers, memory_budget, coordinate_columns, tiled
+            )
+        elif linkage:
+            self.update_linkage(details, max_radians, max_seconds)
+            details = group.get_linkage_clusters(
+                details, self.linkage, 'radians', max_radians, 'seconds', max_seconds
+            )
+        else:
+            # the distance graph is only needed for Location ID, as Cluster ID comes from the duration graph
+            distance_radians = None
+            if not tiled:
+                distance_radians = calculate.distance_graph(
+                    details, self.columns['latitude'], self.columns['longitude'], max_radians
+                )
+            duration_seconds = calculate.duration_graph(details, self.columns['time'], max_seconds)
+            details = group.get_clusters(
+                details, distance_radians, 'radians', max_radians, duration_seconds, 'seconds', max_seconds,
+                workers, coordinate_columns=coordinate_columns, tiled=tiled
+            )
+
+        features = summary.get_features(
+            details,
+            self.distance_tree, 'radians',
+            details[self.columns['time']], 'seconds', memory_budget=memory_budget, neighbors=self.neighbors
+        )
+
+        location_summary = summary.get_location_summary(
+            details, self.distance_tree, 'radians', features=features
+        )
+
+        time_summary = summary.get_time_summary(
+            details, details[self.columns['time']], 'seconds', features=features
+        )
+
+        cluster_summary, details, cluster_boundary = summary.get_cluster_summary(
+            details,
+            self.distance_tree, 'radians',
+            details[self.columns['time']], 'seconds',
+            self.columns['time'], features=features
+        )
+
+        columns = ['Cluster ID', 'Location ID', 'Time ID'] + list(features['Cluster ID'].columns)
+        result = {
+            'details': {column: details[column].to_numpy() for column in columns},
+            'location_summary': location_summary,
+            'time_summary': time_summary,
+            'cluster_summary': cluster_summary,
+            'cluster_boundary': cluster_boundary,
+            'id_index': crossfilter.id_index(details)
+        }
+        self.results.put(key, result)
+
+        return result
+
+
+    @performance.timing
+    def apply_result(self, result):
+
+        for column, values in result['details'].items():
+            self.details[column] = values.copy()
+
+        # summaries are modified when displayed
+        self.location_summary = result['location_summary'].copy()
+        self.time_summary = result['time_summary'].copy()
+        self.cluster_summary = result['cluster_summary'].copy()
+        self.cluster_boundary = result['cluster_boundary']
+        self.id_index = result['id_index']
+
+
+    def estimate_parameters(self):
+        '''Distance and time to the nearest other record, in radians and seconds, sorted for display.'''
+
+        self.estimate = {
+            'distance': calculate.nearest_point(self.distance_tree, 'radians').sort_values(ignore_index=True),
+            'time': calculate.nearest_time(self.details[self.columns['time']], 'seconds').sort_values(ignore_index=True)
+        }
+
+
+    def update_linkage(self, details, max_radians, max_seconds):
+        '''Precompute the linkage so that nearby thresholds only require relabeling.
+
+        Time gaps and cluster edges come from the pairs within a duration, so are kept with headroom. The
+        location forest needs every pair within the distance, so it is kept without headroom and only
+        rebuilt when the distance threshold goes up.
+        '''
+
+        location_radians = max_radians
+        location = None
+        if self.linkage is not None:
+            if max_radians <= self.linkage['location_radians'] and max_seconds <= self.linkage['max_seconds']:
+                return
+            if max_radians <= self.linkage['location_radians']:
+                location_radians = self.linkage['location_radians']
+                location = self.linkage['location']
+            max_seconds = max(max_seconds, self.linkage['max_seconds'])
+
+        self.linkage = group.get_linkage(
+            details, self.columns['latitude'], self.columns['longitude'], self.columns['time'],
+            location_radians*self.linkage_headroom, max_seconds*self.linkage_headroom, location_radians, location
+        )
+
+
+    @performance.timing
+    def write_results(self, directory, distance_units, time_units):
+        '''Write the labeled details and each summary as parquet files, with features in the units.'''
+
+        directory = Path(directory)
+        directory.mkdir(parents=True, exist_ok=True)
+
+        # internal columns are only used for display
+        columns = [col for col in self.details.columns if not col.startswith('_')]
+        details = summary.convert_units(self.details[columns], distance_units, time_units)
+        details.to_parquet(directory / 'details.parquet')
+
+        for name in ['location_summary', 'time_summary', 'cluster_summary']:
+            converted = summary.convert_units(getattr(self, name), distance_units, time_units)
+            converted.to_parquet(directory / f'{name}.parquet')
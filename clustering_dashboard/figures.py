@@ -6,10 +6,11 @@ from bokeh.models import (
     ColumnDataSource, DataTable, HoverTool, ColorBar, 
     DatetimeTickFormatter, TableColumn, Button, Select, 
     NumericInput, TableColumn, DateFormatter, StringFormatter, NumberFormatter,
-    HTMLTemplateFormatter, Slider, DatetimeRangeSlider
+    HTMLTemplateFormatter, Slider, DatetimeRangeSlider, Div, Toggle
 )
 
 from clustering_dashboard.selections import selections
+from clustering_dashboard import performance
 
 class figures(selections):
 
@@ -43,6 +44,8 @@ class figures(selections):
         self.cluster_map()
         self.cluster_detail()
 
+        self.diagnostics_table()
+
 
     def units_distance(self):
 
@@ -73,6 +76,15 @@ class figures(selections):
         self.options['reset'] = Button(label="Reset Selections", button_type="default", width=100, height=30)
         self.options['reset'].on_click(self.reset_click)
 
+        self.options['status'] = Div(text='', width=100)
+
+        # hidden unless showing diagnostics, but can be toggled by name from a live session
+        self.options['profiling'] = Toggle(
+            label="Profile Callbacks", name='profiling', visible=self.diagnostics,
+            active=performance.profiling['directory'] is not None, width=100, height=30
+        )
+        self.options['profiling'].on_change('active', self.profiling_selected)
+
 
     def parameter_estimate(self):
 
@@ -210,6 +222,26 @@ class figures(selections):
         self.table_detail = DataTable(source=self.source_detail, columns=columns, autosize_mode='none', height=625, width=625)        
 
 
+    def diagnostics_table(self):
+
+        columns = [TableColumn(field='span', formatter=self.display_format['string'], width=300)]
+        columns += [TableColumn(field=col, formatter=self.display_format['int'], width=60) for col in ['count']]
+        columns += [
+            TableColumn(field=col, formatter=self.display_format['seconds'], width=70)
+            for col in ['total', 'p50', 'p90', 'p99', 'max']
+        ]
+        columns += [TableColumn(field=col, formatter=self.display_format['int'], width=100) for col in ['rows', 'bytes']]
+
+        self.source_diagnostics = ColumnDataSource(data=dict())
+        self.table_diagnostics = DataTable(
+            source=self.source_diagnostics, columns=columns, index_position=None,
+            autosize_mode='none', height=300, width=770
+        )
+
+        self.options['diagnostics'] = Button(label="Refresh Diagnostics", button_type="default", width=150, height=30)
+        self.options['diagnostics'].on_click(self.diagnostics_click)
+
+
     def cluster_map(self):
 
         points = self.details[['_longitude_mercator','_latitude_mercator']].rename(columns={'_longitude_mercator': 'x', '_latitude_mercator': 'y'})
@@ -267,6 +299,7 @@ class figures(selections):
             'id': NumberFormatter(format='0'),
             'int': NumberFormatter(nan_format='-'),
             'float': NumberFormatter(nan_format='-', format='0.00'),
+            'seconds': NumberFormatter(nan_format='-', format='0.0000'),
             'time': DateFormatter(format="%m/%d/%Y", nan_format='-'),
             'timestamp': DateFormatter(format="%m/%d/%Y %H:%M:%S", nan_format='-'),
             'string': StringFormatter(nan_format='-')
@@ -1,70 +1,335 @@
 import numpy as np
 import pandas as pd
-from scipy.sparse.csgraph import connected_components
+from scipy import sparse
+from scipy.sparse.csgraph import connected_components, minimum_spanning_tree
+from scipy.cluster.hierarchy import DisjointSet
+from sklearn.metrics.pairwise import haversine_distances
+
+
+from clustering_dashboard import convert, calculate, parallel, performance
+
+@performance.timing
+def get_clusters(df, distance_radians, distance_units, distance_threshold, duration_seconds, time_units, time_threshold, workers=None, memory_budget=None, coordinate_columns=None, tiled=False):
+    '''Label records for the same location, time, and location and time.
+
+    With workers, records are split at the time gaps exceeding the threshold and the Cluster ID of each
+    segment is labeled in a process pool, reordering records that aren't sorted by time. Blocked matrices
+    are labeled a block of rows at a time, with the rows of each block limited by the memory budget. With the latitude and longitude coordinate_columns
+    and a sparse duration graph, Cluster ID is labeled from the pairs of the graph within the distance
+    threshold, so the distance graph is only needed for Location ID. With tiled, Location ID is instead
+    labeled from tiles of the coordinates, using the process pool of any workers, and distance_radians
+    isn't needed.
+    '''
+
+    if tiled and coordinate_columns is None:
+        raise RuntimeError('Tiled locations require the coordinate columns.')
+    band = coordinate_columns is not None and sparse.issparse(duration_seconds)
+
+    if isinstance(distance_radians, np.memmap) or isinstance(duration_seconds, np.memmap):
+        threshold_distance = convert.distance_to_radians(distance_threshold, distance_units)
+        threshold_time = convert.time_to_seconds(time_threshold, time_units)
+        location_id, time_id, cluster_id = assign_block_id(
+            distance_radians, threshold_distance, duration_seconds, threshold_time, memory_budget
+        )
+        if tiled:
+            location_id = get_location_id(df, *coordinate_columns, distance_units, distance_threshold, workers)
+    else:
+        # label records for same location
+        if not tiled or not band:
+            distance_criteria = compare_distance(distance_radians, distance_units, distance_threshold)
+        if tiled:
+            location_id = get_location_id(df, *coordinate_columns, distance_units, distance_threshold, workers)
+        else:
+            location_id = assign_id(distance_criteria)
+
+        # label records for same time
+        time_criteria = compare_time(duration_seconds, time_units, time_threshold)
+        if sparse.issparse(duration_seconds):
+            time_id = assign_time_id(time_criteria)
+        else:
+            time_id = assign_id(time_criteria)
+
+        # label records for same location and time
+        if band:
+            coords = np.radians(df[coordinate_columns].values)
+            threshold_converted = convert.distance_to_radians(distance_threshold, distance_units)
+            comparison_criteria = [_band_criteria(time_criteria, coords, threshold_converted)]
+        else:
+            comparison_criteria = [distance_criteria, time_criteria]
+        if workers is None:
+            cluster_id = assign_id(comparison_criteria)
+        else:
+            cluster_id = assign_segment_id(comparison_criteria, time_id, workers)
 
+    # assign to original input
+    df[['Location ID', 'Time ID', 'Cluster ID']] = pd.DataFrame({
+        'Location ID': location_id.values, 'Time ID': time_id.values, 'Cluster ID': cluster_id.values
+    }, index=df.index)
 
-from clustering_dashboard import convert
+    return df
 
-def assign_id(details, input_columns, output_name):
 
-    id_name = f'{output_name} ID'
+def _band_criteria(time_criteria, coords, threshold, block_size=2**22):
+    '''Pairs of a sparse time graph whose records are also within the distance threshold in radians.
+
+    Distances are only calculated for the pairs of the graph, a block of pairs at a time.
+    '''
+
+    pairs = sparse.triu(time_criteria, k=1).tocoo()
+    keep = np.zeros(len(pairs.row), dtype=bool)
+    for start in range(0, len(keep), block_size):
+        row = pairs.row[start:start+block_size]
+        col = pairs.col[start:start+block_size]
+        keep[start:start+block_size] = calculate.pair_radians(coords[row], coords[col]) <= threshold
+
+    criteria = sparse.csr_matrix(
+        (np.ones(keep.sum(), dtype=bool), (pairs.row[keep], pairs.col[keep])), shape=time_criteria.shape
+    )
+
+    return criteria
+
+
+@performance.timing
+def get_linkage(df, column_latitude, column_longitude, column_time, max_radians, max_seconds, location_radians=None, location=None):
+    '''Precompute sorted single-linkage edges up to a maximum distance and duration.
+
+    Cluster edges come from the pairs within max_seconds in time order that are within max_radians, so
+    spatial pairs are never all held. The location forest needs every pair within a distance, so it is
+    only computed up to location_radians, by default max_radians, or reused from the location edges of a
+    previous linkage up to location_radians.
+    '''
+
+    if location_radians is None:
+        location_radians = max_radians
+
+    # location: minimum spanning forest, with zero distances offset since they are otherwise treated as missing
+    if location is None:
+        distance_radians = calculate.distance_graph(df, column_latitude, column_longitude, location_radians)
+        distance_radians.data[distance_radians.data==0] = np.finfo(float).tiny
+        forest = minimum_spanning_tree(distance_radians).tocoo()
+        del distance_radians
+        location = pd.DataFrame({'row': forest.row, 'col': forest.col, 'distance': forest.data})
+        location.loc[location['distance']==np.finfo(float).tiny, 'distance'] = 0
+        location = location.sort_values('distance', kind='stable', ignore_index=True)
+
+    # time: gaps between consecutive records in time order
+    time = df[column_time].view('int64').to_numpy()
+    order = np.argsort(time, kind='stable')
+    gaps = np.diff(time[order]) / 10**9
+
+    # cluster: each candidate pair within both maximums
+    coords = np.radians(df[[column_latitude, column_longitude]].values)
+    cluster = _band_edges(coords, time, order, max_radians, max_seconds)
+    cluster = cluster.sort_values('distance', kind='stable', ignore_index=True)
+
+    linkage = {
+        'size': len(df), 'max_radians': max_radians, 'max_seconds': max_seconds, 'location_radians': location_radians,
+        'location': location, 'order': order, 'gaps': gaps, 'cluster': cluster
+    }
+
+    return linkage
+
+
+def _band_edges(coords, time, order, max_radians, max_seconds, block_size=2**22):
+    '''Pairs of records within max_seconds of each other that are also within max_radians.
+
+    Each record in time order is paired with the band of later records within max_seconds, with the
+    distances calculated for blocks of about block_size pairs so only the pairs within max_radians are kept.
+    '''
+
+    time = time[order]
+    position = np.arange(len(time))
+    end = np.searchsorted(time, time + int(round(max_seconds * 10**9)), side='right')
+    count = end - position - 1
+    total = np.concatenate([[0], np.cumsum(count)])
+
+    edges = [pd.DataFrame({
+        'row': np.array([], dtype=order.dtype), 'col': np.array([], dtype=order.dtype),
+        'distance': np.array([], dtype=float), 'duration': np.array([], dtype=float)
+    })]
+    start = 0
+    while start < len(time):
+        stop = min(max(np.searchsorted(total, total[start] + block_size, side='right') - 1, start + 1), len(time))
+        first = np.repeat(position[start:stop], count[start:stop])
+        second = first + 1 + np.arange(len(first)) - np.repeat(total[start:stop] - total[start], count[start:stop])
+        distance = calculate.pair_radians(coords[order[first]], coords[order[second]])
+        keep = distance <= max_radians
+        edges += [pd.DataFrame({
+            'row': order[first[keep]], 'col': order[second[keep]], 'distance': distance[keep],
+            'duration': (time[second[keep]] - time[first[keep]]) / 10**9
+        })]
+        start = stop
+    edges = pd.concat(edges, ignore_index=True)
+
+    return edges
+
+
+@performance.timing
+def get_linkage_clusters(df, linkage, distance_units, distance_threshold, time_units, time_threshold):
+
+    threshold_distance = convert.distance_to_radians(distance_threshold, distance_units)
+    threshold_time = convert.time_to_seconds(time_threshold, time_units)
+    max_radians = min(linkage['max_radians'], linkage['location_radians'])
+    if threshold_distance > max_radians or threshold_time > linkage['max_seconds']:
+        raise RuntimeError('Threshold exceeds the maximum of the precomputed linkage.')
 
-    # combine geo and time cluster ids
-    overall = details.groupby(input_columns).ngroup()
-    overall = overall.astype('Int64')
-    overall[overall==-1] = None
-    overall.name = 'Grouped'
-    overall = overall.reset_index()
+    # label records for same location
+    location = _linkage_edges(linkage['location'], threshold_distance)
+    location_id = _linkage_components(location, linkage['size'])
 
-    # calculate size of each cluster
-    size = overall['Grouped'].value_counts()
-    size.name = '# Points'
-    size.index.name = 'Grouped'
-    size = size.reset_index()
+    # label records for same time
+    split = np.concatenate([[0], np.cumsum(linkage['gaps'] > threshold_time)])
+    time_label = np.empty(linkage['size'], dtype=split.dtype)
+    time_label[linkage['order']] = split
+    time_id = _rank_labels(_first_appearance(time_label))
 
-    # require multiple points for a cluster
-    size = size[size['# Points']>1]
+    # label records for same location and time
+    cluster = _linkage_edges(linkage['cluster'], threshold_distance)
+    cluster = cluster[cluster['duration']<=threshold_time]
+    cluster_id = _linkage_components(cluster, linkage['size'])
 
-    # assign 0 as the largest sized cluster
-    size[id_name] = range(0,len(size))
-    overall = overall.merge(size, on='Grouped', how='left')
-    overall[id_name] = overall[id_name].astype('Int64')
+    # assign to original input
+    df['Location ID'] = location_id.values
+    df['Time ID'] = time_id.values
+    df['Cluster ID'] = cluster_id.values
 
-    # add id to original input
-    if id_name in details:
-        details = details.drop(columns=id_name)
-    details = details.merge(overall[[id_name]], left_index=True, right_index=True, how='left')
+    return df
 
 
-    return details
+def _linkage_edges(edges, threshold):
+    '''Edges sorted by distance that are within the threshold.'''
 
+    end = np.searchsorted(edges['distance'].values, threshold, side='right')
 
-def get_clusters(df, distance_radians, distance_units, distance_threshold, duration_seconds, time_units, time_threshold):
+    return edges.iloc[:end]
 
-    # label records for same location
-    distance_criteria = compare_distance(distance_radians, distance_units, distance_threshold)
-    location_id = assign_id(distance_criteria)
 
-    # label records for same time
-    time_criteria = compare_time(duration_seconds, time_units, time_threshold)
-    time_id = assign_id(time_criteria)
+def _linkage_components(edges, size):
 
-    # label records for same location and time
-    cluster_id = assign_id([distance_criteria, time_criteria])
+    graph = sparse.coo_matrix(
+        (np.ones(len(edges), dtype=bool), (edges['row'].values, edges['col'].values)),
+        shape=(size, size)
+    )
+    _, cluster_label = connected_components(graph, directed=False)
 
-    # assign to original input
-    df[['Location ID', 'Time ID', 'Cluster ID']] = pd.DataFrame({
-        'Location ID': location_id, 'Time ID': time_id, 'Cluster ID': cluster_id
-    })
+    cluster_label = _rank_labels(cluster_label)
+
+    return cluster_label
+
+
+def _first_appearance(cluster_label):
+    '''Renumber labels in order of first appearance, matching connected_components.'''
+
+    _, first, inverse = np.unique(cluster_label, return_index=True, return_inverse=True)
+    cluster_label = np.argsort(np.argsort(first))[inverse]
+
+    return cluster_label
 
-    return df
+
+@performance.timing
+def get_location_id(df, column_latitude, column_longitude, distance_units, distance_threshold, workers=None):
+    '''Label records for the same location by clustering tiles concurrently and merging across tile borders.
+
+    Tiles are at least the threshold in size so each tile plus a halo of the adjacent tiles holds every
+    record within the threshold of the tile. Longitude isn't wrapped at the antimeridian.
+    '''
+
+    threshold_converted = convert.distance_to_radians(distance_threshold, distance_units)
+    coords = np.radians(df[[column_latitude, column_longitude]].values)
+
+    # widen longitude tiles for the largest latitude so distances never span more than one tile
+    size_latitude = max(threshold_converted, np.finfo(float).eps)
+    size_longitude = size_latitude / max(np.cos(np.abs(coords[:,0]).max()), np.finfo(float).eps)
+    tile = np.floor(coords / [size_latitude, size_longitude]).astype('int64')
+    tile_id, tile_label = np.unique(tile, axis=0, return_inverse=True)
+    tile_label = tile_label.reshape(-1)
+
+    # records of each tile are a contiguous range of the order
+    order = np.argsort(tile_label, kind='stable')
+    offset = np.concatenate([[0], np.cumsum(np.bincount(tile_label, minlength=len(tile_id)))])
+    lookup = {tuple(key): index for index, key in enumerate(tile_id)}
+
+    tasks = []
+    for index, key in enumerate(tile_id):
+        core = order[offset[index]:offset[index+1]]
+        halo = [
+            order[offset[lookup[neighbor]]:offset[lookup[neighbor]+1]]
+            for neighbor in [(key[0]+i, key[1]+j) for i in (-1,0,1) for j in (-1,0,1) if i!=0 or j!=0]
+            if neighbor in lookup
+        ]
+        halo = np.concatenate([np.array([], dtype=core.dtype)] + halo)
+        tasks += [(core, halo, coords[core], coords[halo], threshold_converted)]
+
+    # combine tiles into a few batches per worker to limit the overhead of each task
+    batches = np.array_split(np.arange(len(tasks)), min(len(tasks), (workers or 1) * 4))
+    batches = [([tasks[index] for index in batch],) for batch in batches]
+    components = parallel.map_tasks(_tile_batch, batches, workers)
+    components = [component for batch in components for component in batch]
+
+    # component of each record before merging across tiles
+    label = np.empty(len(coords), dtype='int64')
+    shift = 0
+    pairs = []
+    for (core, _, _, _, _), (core_label, cross) in zip(tasks, components):
+        label[core] = core_label + shift
+        shift += core_label.max() + 1
+        pairs += [cross]
+    pairs = np.concatenate([np.empty((0,2), dtype='int64')] + pairs)
+
+    # union-find merge of tile components that are connected across a tile border
+    pairs = np.unique(label[pairs], axis=0)
+    merged = DisjointSet(np.unique(pairs))
+    for first, second in pairs:
+        merged.merge(first, second)
+    root = np.arange(shift)
+    for component in merged:
+        root[component] = merged[component]
+    label = root[label]
+
+    location_id = _rank_labels(_first_appearance(label))
+
+    return location_id
+
+
+def _tile_batch(tasks):
+
+    return [_tile_components(*task) for task in tasks]
+
+
+def _tile_components(core, halo, coords_core, coords_halo, threshold, block_size=1024):
+    '''Components of the records in a tile and the pairs connecting them to records in the halo.'''
+
+    coords_neighbor = np.concatenate([coords_core, coords_halo])
+    neighbor = np.concatenate([core, halo])
+
+    # limit memory for a dense tile by comparing blocks of records in the tile
+    row, col = [], []
+    for start in range(0, len(core), block_size):
+        within = haversine_distances(coords_core[start:start+block_size], coords_neighbor) <= threshold
+        block_row, block_col = np.nonzero(within)
+        row += [block_row + start]
+        col += [block_col]
+    row = np.concatenate(row)
+    col = np.concatenate(col)
+
+    inside = col < len(core)
+    graph = sparse.coo_matrix(
+        (np.ones(inside.sum(), dtype=bool), (row[inside], col[inside])), shape=(len(core), len(core))
+    )
+    _, core_label = connected_components(graph, directed=False)
+    cross = np.column_stack([core[row[~inside]], neighbor[col[~inside]]])
+
+    return core_label, cross
 
 
 def compare_distance(distance_radians, distance_units, distance_threshold):
 
     threshold_converted = convert.distance_to_radians(distance_threshold, distance_units)
 
-    distance_criteria = (np.array(distance_radians) <= threshold_converted)
+    if sparse.issparse(distance_radians):
+        distance_criteria = _compare_graph(distance_radians, threshold_converted)
+    else:
+        distance_criteria = (np.array(distance_radians) <= threshold_converted)
 
     return distance_criteria
 
@@ -73,26 +338,182 @@ def compare_time(duration_seconds, time_units, time_threshold):
 
     threshold_converted = convert.time_to_seconds(time_threshold, time_units)
 
-    duration_criteria = (np.array(duration_seconds) <= threshold_converted)
+    if sparse.issparse(duration_seconds):
+        duration_criteria = _compare_graph(duration_seconds, threshold_converted)
+    else:
+        duration_criteria = (np.array(duration_seconds) <= threshold_converted)
 
     return duration_criteria
 
 
+def _compare_graph(graph, threshold):
+    '''Keep only the stored pairs of a sparse graph that are within the threshold.'''
+
+    criteria = graph.tocsr(copy=True)
+    criteria.data = criteria.data <= threshold
+    criteria.eliminate_zeros()
+
+    return criteria
+
+
+def assign_block_id(distance_radians, distance_threshold, duration_seconds, time_threshold, memory_budget=None):
+    '''Label Location, Time and Cluster IDs from blocks of rows of blocked matrices.
+
+    The pairs within the thresholds of each block are merged into the components of the blocks before
+    it, so the pairs of all records are never held at once.
+    '''
+
+    size = distance_radians.shape[0]
+    rows = calculate.block_rows(size, memory_budget)
+    labels = [np.arange(size) for _ in range(3)]
+    for start in range(0, size, rows):
+        distance = distance_radians[start:start+rows] <= distance_threshold
+        labels[0] = _merge_components(labels[0], start, distance)
+        duration = duration_seconds[start:start+rows] <= time_threshold
+        labels[1] = _merge_components(labels[1], start, duration)
+        labels[2] = _merge_components(labels[2], start, distance & duration)
+
+    location_id, time_id, cluster_id = [_rank_labels(_first_appearance(label)) for label in labels]
+
+    return location_id, time_id, cluster_id
+
+
+def _merge_components(label, start, within):
+    '''Components of records after connecting the components of the pairs within a block starting at a row.'''
+
+    row, col = np.nonzero(within)
+    row += start
+    graph = sparse.coo_matrix(
+        (np.ones(len(row), dtype=bool), (label[row], label[col])), shape=(len(label), len(label))
+    )
+    _, component = connected_components(graph, directed=False)
+
+    return component[label]
+
+
 def assign_id(comparison_criteria):
 
     if isinstance(comparison_criteria, list):
-        comparison_criteria = np.array(comparison_criteria)
-        comparison_criteria = np.all(comparison_criteria, axis=0)
+        comparison_criteria = _combine_criteria(comparison_criteria)
 
     _, cluster_label = connected_components(comparison_criteria)
 
+    cluster_label = _rank_labels(cluster_label)
+
+    return cluster_label
+
+
+def time_segments(time_id, workers):
+    '''Split records into contiguous ranges that never divide records with the same Time ID.'''
+
+    # a range can start wherever the id changes when the records of each id are contiguous
+    label = np.asarray(time_id)
+    if not _contiguous(label):
+        raise RuntimeError('Records must be sorted by time.')
+    start = np.flatnonzero(np.concatenate([[True], label[1:]!=label[:-1]]))
+
+    # combine segments into a few ranges per worker to limit the overhead of each task
+    size = max(int(np.ceil(len(label) / (workers * 4))), 1)
+    _, first = np.unique(start // size, return_index=True)
+    start = start[first]
+
+    segments = list(zip(start, np.append(start[1:], len(label))))
+
+    return segments
+
+
+def _contiguous(time_label):
+    '''Whether the records of each Time ID are contiguous, as they are for records sorted by time.'''
+
+    start = np.concatenate([[True], time_label[1:]!=time_label[:-1]])
+    label = time_label[start]
+    label = label[label>=0]
+
+    return len(np.unique(label)) == len(label)
+
+
+def assign_segment_id(comparison_criteria, time_id, workers):
+    '''Label each time segment independently and combine into ids for all records.
+
+    Records that aren't sorted by time are ordered by Time ID for the segments and their labels mapped back.
+    '''
+
+    time_label = time_id.to_numpy()
+    order = None
+    if not _contiguous(time_label):
+        order = np.argsort(time_label, kind='stable')
+        comparison_criteria = [criteria[order][:, order] for criteria in comparison_criteria]
+        time_label = time_label[order]
+    segments = time_segments(time_label, workers)
+
+    tasks = [
+        ([criteria[start:end, start:end] for criteria in comparison_criteria],)
+        for start, end in segments
+    ]
+    labels = parallel.map_tasks(_segment_components, tasks, workers)
+
+    # offset each segment so labels remain in order of first appearance
+    offset = np.cumsum([0] + [label.max()+1 for label in labels[:-1]])
+    cluster_label = np.concatenate([label + shift for label, shift in zip(labels, offset)])
+
+    if order is not None:
+        reordered = cluster_label
+        cluster_label = np.empty_like(reordered)
+        cluster_label[order] = reordered
+        cluster_label = _first_appearance(cluster_label)
+
+    cluster_label = _rank_labels(cluster_label)
+
+    return cluster_label
+
+
+def _segment_components(comparison_criteria):
+
+    _, cluster_label = connected_components(_combine_criteria(comparison_criteria))
+
+    return cluster_label
+
+
+def _combine_criteria(comparison_criteria):
+    '''Require all criteria for a pair of records.'''
+
+    if any(sparse.issparse(criteria) for criteria in comparison_criteria):
+        combined = sparse.csr_matrix(comparison_criteria[0])
+        for criteria in comparison_criteria[1:]:
+            combined = combined.multiply(sparse.csr_matrix(criteria)).tocsr()
+    else:
+        combined = np.all(np.array(comparison_criteria), axis=0)
+
+    return combined
+
+
+def assign_time_id(time_criteria):
+    '''Label records of a time sorted banded graph using the gaps between consecutive records.'''
+
+    # a record starts a new group when it isn't within the threshold of the previous record
+    consecutive = time_criteria.diagonal(k=1).astype(bool)
+    cluster_label = np.concatenate([[0], np.cumsum(~consecutive)])
+
+    cluster_label = _rank_labels(cluster_label)
+
+    return cluster_label
+
+
+def _rank_labels(cluster_label):
+    '''Number groups by descending size, with ties in order of the labels, and assign -1 to noise points.
+
+    Labels are numbered in order of first appearance, as from connected_components.
+    '''
+
+    cluster_label = np.asarray(cluster_label)
+    size = np.bincount(cluster_label)
+
     # assign lower id values to larger sized groups and assign noise points
-    cluster_label = pd.DataFrame(cluster_label, columns=['Original'])
-    arranged = pd.DataFrame(cluster_label.value_counts(), columns=['Size'])
-    arranged['ID'] = range(0, len(arranged))
-    arranged['ID'] = arranged['ID'].astype('Int64')
-    arranged.loc[arranged['Size']==1, 'ID'] = pd.NA
-    cluster_label = cluster_label.merge(arranged[['ID']], left_on='Original', right_index=True)
-    cluster_label = cluster_label['ID'].sort_index()
+    order = np.argsort(-size, kind='stable')
+    lookup = np.empty(len(size), dtype='int32')
+    lookup[order] = np.arange(len(size), dtype='int32')
+    lookup[size==1] = -1
+
+    cluster_label = pd.Series(lookup[cluster_label], name='ID')
 
     return cluster_label
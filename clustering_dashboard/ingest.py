@@ -0,0 +1,93 @@
+from pathlib import Path
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.csv as csv
+import pyarrow.parquet as pq
+
+from clustering_dashboard import performance
+
+# bytes of csv text parsed at a time
+BLOCK_SIZE = 2**24
+
+
+def file_format(file_name):
+    '''Format of a file from the extension of its name.'''
+
+    suffix = Path(file_name).suffix.lower()
+    if suffix == '.csv':
+        return 'csv'
+    elif suffix == '.parquet':
+        return 'parquet'
+    else:
+        raise RuntimeError('Invalid file type.')
+
+
+def read_schema(buffer_or_path, source_format='parquet'):
+    '''Column names of a file without reading the records.'''
+
+    if source_format == 'parquet':
+        schema = pq.read_schema(buffer_or_path)
+    elif source_format == 'csv':
+        with csv.open_csv(buffer_or_path, read_options=csv.ReadOptions(block_size=BLOCK_SIZE)) as reader:
+            schema = reader.schema
+    else:
+        raise RuntimeError('Invalid file type.')
+    _rewind(buffer_or_path)
+
+    return [name for name in schema.names if not name.startswith('__index_level_')]
+
+
+def buffer_format(buffer):
+    '''Format of an uploaded file from its leading bytes, as parquet files start with PAR1.'''
+
+    magic = buffer.read(4)
+    _rewind(buffer)
+
+    return 'parquet' if magic == b'PAR1' else 'csv'
+
+
+@performance.timing
+def read_records(buffer_or_path, source_format='parquet', columns=None, column_time=None):
+    '''Read records, optionally only some columns.
+
+    Csv files are read in blocks with ISO 8601 times parsed as timestamps. Times in other formats or
+    with zone offsets are kept as text, so that any format pandas accepts is parsed when the details
+    are prepared.
+    '''
+
+    if source_format == 'parquet':
+        df = pd.read_parquet(buffer_or_path, columns=columns)
+    elif source_format == 'csv':
+        try:
+            df = _read_csv(buffer_or_path, columns, column_time, pa.timestamp('ns'))
+        except pa.ArrowInvalid:
+            _rewind(buffer_or_path)
+            df = _read_csv(buffer_or_path, columns, column_time, pa.string())
+    else:
+        raise RuntimeError('Invalid file type.')
+    _rewind(buffer_or_path)
+
+    return df
+
+
+def _read_csv(buffer_or_path, columns, column_time, time_type):
+
+    convert_options = csv.ConvertOptions(include_columns=columns, timestamp_parsers=[csv.ISO8601])
+    if column_time is not None:
+        convert_options.column_types = {column_time: time_type}
+    with csv.open_csv(
+        buffer_or_path, read_options=csv.ReadOptions(block_size=BLOCK_SIZE), convert_options=convert_options
+    ) as reader:
+        table = pa.Table.from_batches(reader, schema=reader.schema)
+    # release each arrow column once converted
+    df = table.to_pandas(split_blocks=True, self_destruct=True)
+    del table
+
+    return df
+
+
+def _rewind(buffer_or_path):
+
+    if hasattr(buffer_or_path, 'seek'):
+        buffer_or_path.seek(0)
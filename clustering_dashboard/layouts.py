@@ -1,5 +1,7 @@
+import os
+
 import pandas as pd
-from bokeh.models import Div, FileInput, Select, Panel, Tabs
+from bokeh.models import Button, Div, FileInput, Select, MultiChoice, Panel, Tabs
 from bokeh.layouts import row, column
 
 from clustering_dashboard.configuration import configuration
@@ -7,6 +9,9 @@ from clustering_dashboard.configuration import configuration
 
 class layouts(configuration):
 
+    # show timing of each stage in a tab, when the environment variable is set
+    diagnostics = bool(os.environ.get('CLUSTERING_DIAGNOSTICS'))
+
     def __init__(self):
 
         self.generate_parameters()
@@ -19,7 +24,6 @@ class layouts(configuration):
             style={'font-size': '150%', 'font-weight': 'bold'}, width=400
         )
 
-        # BUG: allow csv files
         file_types = Div(
             text='Select a comma seperated value (.csv) or parquet (.parquet) file.'
         )
@@ -28,7 +32,7 @@ class layouts(configuration):
         self.file_input.on_change('value', self._file_selected)
 
         title_columns = Div(
-            text = 'Select columns from input file.'
+            text = 'Select columns from input file, then load them.'
         )
 
         self.column_options = {
@@ -41,15 +45,24 @@ class layouts(configuration):
             opt.on_change('value', self._columns_selected)
         self.columns = pd.Series({col:None for col in self.column_options.keys()})
 
+        # additional columns to load for the record detail table
+        self.detail_options = MultiChoice(title="Select Detail Columns", value=[], options=[], width=200)
+
+        # columns are only read once confirmed, so they can be chosen in any order
+        self.load_columns = Button(label='Load Columns', button_type='success', disabled=True, width=200)
+        self.load_columns.on_click(self._columns_confirmed)
+
         self.layout_parameters = column(
             title_main,
             file_types,
             self.file_input,
             title_columns,
+            self.detail_options,
             self.column_options['id'],
             self.column_options['latitude'],
             self.column_options['longitude'], 
-            self.column_options['time']
+            self.column_options['time'],
+            self.load_columns
         )
 
 
@@ -89,6 +102,10 @@ class layouts(configuration):
                 ]), title='Parameter Estimation'
             )
         ])
+        if self.diagnostics:
+            paremeter_or_summary_tab.tabs.append(
+                Panel(child=column(self.options['diagnostics'], self.table_diagnostics), title='Diagnostics')
+            )
 
         self.layout_dashboard = row(
             column(
@@ -103,7 +120,9 @@ class layouts(configuration):
                             space,
                             self.parameters['cluster_time']
                         ),
-                        self.options['reset']
+                        self.options['reset'],
+                        self.options['status'],
+                        self.options['profiling']
                     ),
                     paremeter_or_summary_tab
                 ),
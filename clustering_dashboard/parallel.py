@@ -0,0 +1,13 @@
+from concurrent.futures import ProcessPoolExecutor
+
+
+def map_tasks(function, tasks, workers=None):
+    '''Call function with the arguments of each task, using a process pool when multiple workers are requested.'''
+
+    if workers is None or workers <= 1 or len(tasks) <= 1:
+        return [function(*task) for task in tasks]
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        results = list(executor.map(function, *zip(*tasks)))
+
+    return results
@@ -1,23 +1,213 @@
+from collections import deque
+from contextlib import contextmanager
 from functools import wraps
-from time import time
+from pathlib import Path
+from time import perf_counter
+import cProfile
+import io
+import itertools
+import json
 import os
+import pstats
+import threading
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+from scipy import sparse
+
+
+class registry():
+    '''Duration, rows and bytes of each span, keeping recent durations for percentiles.'''
+
+    def __init__(self, max_samples=1000):
+
+        self.max_samples = max_samples
+        self.lock = threading.Lock()
+        self.spans = {}
+
+
+    def clear(self):
+
+        with self.lock:
+            self.spans = {}
+
+
+    def record(self, path, duration, rows=None, nbytes=None):
+
+        with self.lock:
+            if path not in self.spans:
+                self.spans[path] = {
+                    'count': 0, 'total': 0.0, 'rows': 0, 'bytes': 0,
+                    'durations': deque(maxlen=self.max_samples)
+                }
+            span = self.spans[path]
+            span['count'] += 1
+            span['total'] += duration
+            span['durations'].append(duration)
+            if rows is not None:
+                span['rows'] += rows
+            if nbytes is not None:
+                span['bytes'] += nbytes
+
+
+    def summary(self):
+        '''Count, total and percentiles of the duration in seconds, along with total rows and bytes, of each span.'''
+
+        with self.lock:
+            spans = {path: dict(span, durations=np.array(span['durations'])) for path, span in self.spans.items()}
+
+        summary = {}
+        for path, span in spans.items():
+            p50, p90, p99 = np.percentile(span['durations'], [50, 90, 99])
+            summary[path] = {
+                'count': span['count'], 'total': span['total'],
+                'p50': p50, 'p90': p90, 'p99': p99, 'max': span['durations'].max(),
+                'rows': span['rows'], 'bytes': span['bytes']
+            }
+
+        return summary
+
+
+    def to_frame(self):
+
+        summary = pd.DataFrame.from_dict(self.summary(), orient='index')
+        summary.index.name = 'span'
+
+        return summary
+
+
+    def to_json(self, path=None):
+
+        summary = json.dumps(self.summary(), indent=2, default=float)
+        if path is not None:
+            with open(path, 'w') as file:
+                file.write(summary)
+
+        return summary
+
+
+# spans of the process, nested separately within each thread
+metrics = registry()
+_local = threading.local()
+
+
+@contextmanager
+def span(name, rows=None, nbytes=None):
+    '''Time a block as a span nested within any enclosing span of the same thread.
+
+    Rows and bytes can be set on the yielded dictionary once known.
+    '''
+
+    if not hasattr(_local, 'stack'):
+        _local.stack = []
+    _local.stack.append(name)
+    path = '/'.join(_local.stack)
+
+    measured = {'rows': rows, 'bytes': nbytes}
+    time_start = perf_counter()
+    try:
+        yield measured
+    finally:
+        duration = perf_counter()-time_start
+        _local.stack.pop()
+        metrics.record(path, duration, measured['rows'], measured['bytes'])
+
 
 def timing(f):
-    
+    '''Record each call as a span named by module and function, with the rows and bytes of the result.'''
+
+    name = _span_name(f)
+
     @wraps(f)
     def wrap(*args, **kw):
-        time_start = time()
-        result = f(*args, **kw)
-        duration = time()-time_start
-        file = os.path.split(timing.__globals__['__file__'])[1]
-        func = f.__name__
-        print(f'{file}/{func} {duration:.2f} seconds')
+        with span(name) as measured:
+            result = f(*args, **kw)
+            measured['rows'], measured['bytes'] = _size(result)
         return result
     return wrap
 
-# @timing
-# def test():
-#     from time import sleep
-#     sleep(3)
-#     print(1)
-# test()
+
+def _span_name(f):
+    '''Qualified name of a method, or the module and name of a function.'''
+
+    if '.' in f.__qualname__:
+        return f.__qualname__
+    else:
+        return f"{f.__module__.split('.')[-1]}.{f.__qualname__}"
+
+
+def _size(result):
+
+    if isinstance(result, tuple) and len(result) > 0:
+        result = result[0]
+
+    if isinstance(result, pd.DataFrame):
+        return len(result), int(result.memory_usage(index=False).sum())
+    elif isinstance(result, (pd.Series, np.ndarray)):
+        return len(result), int(result.nbytes)
+    elif sparse.issparse(result):
+        result = result.tocsr()
+        return result.shape[0], int(result.data.nbytes + result.indices.nbytes + result.indptr.nbytes)
+    else:
+        return None, None
+
+
+# profile selected callbacks to a directory, when set in the environment or enabled in a session
+profiling = {'directory': None, 'memory': False, 'top': 30}
+_invocation = itertools.count()
+# only one profiler can be active at a time
+_profiler = threading.Lock()
+
+
+def enable_profiling(directory, memory=False, top=30):
+    '''Write a cProfile file and a summary of the top functions for each profiled call, optionally with memory allocations.'''
+
+    Path(directory).mkdir(parents=True, exist_ok=True)
+    profiling.update({'directory': directory, 'memory': memory, 'top': top})
+
+
+def disable_profiling():
+
+    profiling['directory'] = None
+
+
+def profiled(f):
+    '''Profile each call while profiling is enabled, skipping calls while another call is profiled.'''
+
+    name = _span_name(f)
+
+    @wraps(f)
+    def wrap(*args, **kw):
+        if profiling['directory'] is None or not _profiler.acquire(blocking=False):
+            return f(*args, **kw)
+
+        directory = Path(profiling['directory'])
+        memory = profiling['memory']
+        file_name = f'{name}-{os.getpid()}-{next(_invocation)}'
+
+        if memory:
+            tracemalloc.start()
+        profile = cProfile.Profile()
+        try:
+            return profile.runcall(f, *args, **kw)
+        finally:
+            _profiler.release()
+            profile.dump_stats(directory / f'{file_name}.prof')
+
+            summary = io.StringIO()
+            pstats.Stats(profile, stream=summary).sort_stats('cumulative').print_stats(profiling['top'])
+            if memory:
+                snapshot = tracemalloc.take_snapshot()
+                _, peak = tracemalloc.get_traced_memory()
+                tracemalloc.stop()
+                summary.write(f'Peak traced memory {peak} bytes, top {profiling["top"]} remaining allocations by line\n')
+                for stat in snapshot.statistics('lineno')[:profiling['top']]:
+                    summary.write(f'{stat}\n')
+            (directory / f'{file_name}.txt').write_text(summary.getvalue())
+
+    return wrap
+
+
+if os.environ.get('CLUSTERING_PROFILE'):
+    enable_profiling(os.environ['CLUSTERING_PROFILE'], memory=bool(os.environ.get('CLUSTERING_PROFILE_MEMORY')))
@@ -1,10 +1,24 @@
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+import os
+
+import numpy as np
 import pandas as pd
 
 from clustering_dashboard.updates import updates
-from clustering_dashboard import group, summary, convert
+from clustering_dashboard import convert, crossfilter, performance
 
 class selections(updates):
 
+    # thresholds are being converted to other units
+    converting_units = False
+    # clustering runs in a thread of a server session, where only the latest request is applied
+    executor = None
+    generation = 0
+    # directory for profiles of callbacks, enabled from the environment or the profiling toggle
+    profile_directory = os.environ.get('CLUSTERING_PROFILE') or 'profiles'
+    profile_memory = bool(os.environ.get('CLUSTERING_PROFILE_MEMORY'))
+
     def __init__(self):
 
         updates.__init__(self)
@@ -17,6 +31,7 @@ class selections(updates):
         self.time_summary = None
         self.cluster_boundary = None
         
+        self.estimate_parameters()
         self.update_parameter_estimation()
         self.update_map()
         # clear cluster summary
@@ -24,6 +39,7 @@ class selections(updates):
         # clear cluster evaluation
 
 
+    @performance.timing
     def units_selected(self, attr, old, new):
 
         self.plot_estimate_distance.yaxis.axis_label = self.units["distance"].value
@@ -34,8 +50,37 @@ class selections(updates):
         self.plot_span_distance.xaxis.axis_label = self.units["distance"].value
         self.plot_next_date.xaxis.axis_label = self.units["time"].value
         self.plot_span_date.xaxis.axis_label = self.units["time"].value
-            
-        self.reset_all()
+
+        # keep the same thresholds in the new units so the clusters don't change
+        self.converting_units = True
+        if new in self.units['distance'].options:
+            value = self.parameters['cluster_distance'].value
+            if value is not None:
+                self.parameters['cluster_distance'].value = convert.radians_to_distance(convert.distance_to_radians(value, old), new)
+        else:
+            value = self.parameters['cluster_time'].value
+            if value is not None:
+                self.parameters['cluster_time'].value = convert.seconds_to_time(convert.time_to_seconds(value, old), new)
+        self.converting_units = False
+
+        if self.cluster_summary is None:
+            return
+
+        # summaries are in radians and seconds so only the display changes
+        self.table_location.columns = self.location_summary_columns()
+        self.table_time.columns = self.time_summary_columns()
+        self.table_summary.columns = self.overall_summary_columns()
+
+        self.update_evaluation()
+        self.location_summary = self.update_summary(
+            self.location_summary, self.source_location, 'Location ID', indices_highlight=self.source_location.selected.indices
+        )
+        self.time_summary = self.update_summary(
+            self.time_summary, self.source_time, 'Time ID', indices_highlight=self.source_time.selected.indices
+        )
+        self.cluster_summary = self.update_summary(
+            self.cluster_summary, self.source_summary, 'Cluster ID', indices_highlight=self.source_summary.selected.indices
+        )
 
 
     def reset_click(self, event):
@@ -43,36 +88,97 @@ class selections(updates):
         self.reset_all()
 
 
+    def profiling_selected(self, attr, old, new):
+
+        if new:
+            performance.enable_profiling(self.profile_directory, memory=self.profile_memory)
+        else:
+            performance.disable_profiling()
+
+
+    def diagnostics_click(self, event):
+
+        self.update_diagnostics()
+
+
     def reset_change(self, attr, old, new):
 
+        if self.converting_units:
+            return
+
         self.reset_all()
 
 
+    @performance.timing
+    @performance.profiled
     def reset_all(self):
 
         if self.parameters['cluster_distance'].value is None or self.parameters['cluster_time'].value is None:
             return
 
-        self.details = group.get_clusters(
-            self.details,
-            self.distance_radians, self.units['distance'].value, self.parameters['cluster_distance'].value,
-            self.duration_seconds, self.units['time'].value, self.parameters['cluster_time'].value
+        thresholds = (
+            self.units['distance'].value, self.parameters['cluster_distance'].value,
+            self.units['time'].value, self.parameters['cluster_time'].value
         )
 
-        self.location_summary = summary.get_location_summary(
-            self.details, self.distance_radians, self.units['distance'].value
-        )
-        
-        self.time_summary = summary.get_time_summary(
-            self.details, self.duration_seconds, self.units['time'].value
-        )
+        # without a server document, cluster before returning
+        if self.document is None:
+            self.cluster(*thresholds)
+            self.display_clusters()
+            return
+
+        if self.executor is None:
+            self.executor = ThreadPoolExecutor(max_workers=1)
+
+        # only the latest request is applied
+        self.generation += 1
+        self.options['status'].text = 'Clustering...'
+        self.executor.submit(self._cluster_background, self.generation, self.details.copy(deep=False), thresholds)
+
+
+    @performance.timing
+    @performance.profiled
+    def _cluster_background(self, generation, details, thresholds):
+
+        # skip requests superseded while waiting
+        if generation != self.generation:
+            return
+
+        try:
+            result = self.cluster_result(details, *thresholds)
+        except Exception as error:
+            self.document.add_next_tick_callback(partial(self._cluster_failed, generation, error))
+        else:
+            self.document.add_next_tick_callback(partial(self._cluster_applied, generation, result))
+
+
+    def _cluster_applied(self, generation, result):
+
+        if generation != self.generation:
+            return
+
+        self.apply_result(result)
+        self.options['status'].text = ''
+        self.display_clusters()
+
+
+    def _cluster_failed(self, generation, error):
+
+        if generation != self.generation:
+            return
+
+        self.options['status'].text = f'Clustering failed: {error}'
+
+
+    def _session_destroyed(self, session_context):
+
+        if self.executor is not None:
+            self.executor.shutdown(wait=False, cancel_futures=True)
+
+
+    @performance.timing
+    def display_clusters(self):
 
-        self.cluster_summary, self.details, self.cluster_boundary = summary.get_cluster_summary(
-            self.details, 
-            self.distance_radians, self.units['distance'].value, 
-            self.duration_seconds, self.units['time'].value,
-            self.columns['time']
-        )
         self.update_summary_points()
         self.update_summary_first()
 
@@ -111,6 +217,7 @@ class selections(updates):
         self.summary_first.step = int(convert.time_to_seconds(self.parameters['cluster_time'].value, self.units['time'].value)*1000)
 
 
+    @performance.timing
     def filter_cluster_summary(self, attr, old, new):
 
         indices = self.cluster_summary.index[
@@ -128,49 +235,54 @@ class selections(updates):
         self.update_summary_first()
 
 
+    @performance.timing
+    @performance.profiled
     def table_row_selected(self, attr, old, new):
 
         id_location = self.source_location.selected.indices
         id_time = self.source_time.selected.indices
         id_summary = self.source_summary.selected.indices
 
+        # ids of the selected rows, as displayed before any table is filtered
+        location = self.location_summary.index[id_location]
+        time = self.time_summary.index[id_time]
+        cluster = self.cluster_summary.index[id_summary]
+
         if len(id_location)>0:
             # highlight location table
             self.location_summary = self.update_summary(self.location_summary, self.source_location, 'Location ID', indices_highlight=id_location)
-            selected = self.details['Location ID'].isin(id_location)
             # cross filter time table
-            indices_filter = self.details.loc[selected,'Time ID'].dropna().unique()
+            indices_filter = crossfilter.shared_ids(self.id_index, 'Location ID', location, 'Time ID')
             self.time_summary = self.update_summary(self.time_summary, self.source_time, 'Time ID', indices_filter=indices_filter)
             # cross filter summary table
-            indices_filter = self.details.loc[selected,'Cluster ID'].dropna().unique()
-            self.time_summary = self.update_summary(self.cluster_summary, self.source_summary, 'Cluster ID', indices_filter=indices_filter)
+            indices_filter = crossfilter.shared_ids(self.id_index, 'Location ID', location, 'Cluster ID')
+            self.cluster_summary = self.update_summary(self.cluster_summary, self.source_summary, 'Cluster ID', indices_filter=indices_filter)
         if len(id_time)>0:
             # highlight time table
             self.time_summary = self.update_summary(self.time_summary, self.source_time, 'Time ID', indices_highlight=id_time)
-            selected = self.details['Time ID'].isin(id_time)
             # cross filter location table
-            indices_filter = self.details.loc[selected,'Location ID'].dropna().unique()
+            indices_filter = crossfilter.shared_ids(self.id_index, 'Time ID', time, 'Location ID')
             self.location_summary = self.update_summary(self.location_summary, self.source_location, 'Location ID', indices_filter=indices_filter)
             # cross filter summary table
-            indices_filter = self.details.loc[selected,'Cluster ID'].dropna().unique()
-            self.time_summary = self.update_summary(self.cluster_summary, self.source_summary, 'Cluster ID', indices_filter=indices_filter)
+            indices_filter = crossfilter.shared_ids(self.id_index, 'Time ID', time, 'Cluster ID')
+            self.cluster_summary = self.update_summary(self.cluster_summary, self.source_summary, 'Cluster ID', indices_filter=indices_filter)
         if len(id_summary)>0:
             # highlight summary table
             self.cluster_summary = self.update_summary(self.cluster_summary, self.source_summary, 'Cluster ID', indices_highlight=id_summary)
-            selected = self.details['Cluster ID'].isin(id_summary)
             # cross filter time table
-            indices_filter = self.details.loc[selected,'Time ID'].dropna().unique()
+            indices_filter = crossfilter.shared_ids(self.id_index, 'Cluster ID', cluster, 'Time ID')
             self.time_summary = self.update_summary(self.time_summary, self.source_time, 'Time ID', indices_filter=indices_filter)
             # cross filter location table
-            indices_filter = self.details.loc[selected,'Location ID'].dropna().unique()
-            self.location_summary = self.update_summary(self.location_summary, self.source_location, 'Location ID', indices_filter=indices_filter)            
+            indices_filter = crossfilter.shared_ids(self.id_index, 'Cluster ID', cluster, 'Location ID')
+            self.location_summary = self.update_summary(self.location_summary, self.source_location, 'Location ID', indices_filter=indices_filter)
 
-        selected = (
-            self.details['Location ID'].isin(self.location_summary.iloc[id_location].index) |
-            self.details['Time ID'].isin(self.time_summary.iloc[id_time].index) |
-            self.details['Cluster ID'].isin(self.cluster_summary.iloc[id_summary].index)
-        )
-        self.selected_details = self.details.loc[selected]
+        # records with any of the selected ids
+        rows = np.unique(np.concatenate([
+            crossfilter.id_rows(self.id_index, 'Location ID', location),
+            crossfilter.id_rows(self.id_index, 'Time ID', time),
+            crossfilter.id_rows(self.id_index, 'Cluster ID', cluster)
+        ]))
+        self.selected_details = self.details.iloc[rows]
 
         self.update_map()
         self.update_detail()
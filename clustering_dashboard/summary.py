@@ -1,60 +1,91 @@
 import pandas as pd
 import numpy as np
-import numpy.ma as ma
-from scipy.spatial import ConvexHull
+from scipy.spatial import ConvexHull, QhullError
+from sklearn.metrics.pairwise import haversine_distances
+from sklearn.neighbors import BallTree, KDTree
 
-from clustering_dashboard import convert, aggregations
+from clustering_dashboard import convert, calculate, performance
 
 
-def _calc_distance_features(distance_radians, units_distance, row_id, col_id):
+# features summarized for each id
+FEATURES = {'Cluster ID': ['distance', 'time'], 'Location ID': ['distance'], 'Time ID': ['time']}
 
-    distance_nearest_column = f"Nearest Cluster ({units_distance})"
-    distance_length_column = f"Distance ({units_distance})"
-    distance_nearest = find_next_cluster_nearest(
-        'distance', distance_radians, units_distance, row_id, col_id, distance_nearest_column
-    )
-    distance_length = find_same_cluster_length(
-        'distance', distance_radians, units_distance, row_id, col_id, distance_length_column
-    )
 
-    return distance_nearest, distance_length
+@performance.timing
+def get_features(details, distance_radians, units_distance, duration_seconds, units_time, id_columns=None, memory_budget=None, neighbors=None):
+    '''Nearest other cluster and same cluster length of each record for each id in a single stage.
 
+    Group indexes are shared between features and each neighbor query or sort is shared between ids.
+    The memory budget limits the rows of a matrix read at a time. Precomputed neighbors of a spatial
+    index replace most of its queries.
+    '''
 
-def _calc_time_features(duration_seconds, units_time, row_id, col_id):
+    if id_columns is None:
+        id_columns = list(FEATURES.keys())
+    features = {id_column: {} for id_column in id_columns}
 
-    time_nearest_column = f"Nearest Cluster ({units_time})"
-    time_length_column = f"Duration ({units_time})"
-    time_nearest = find_next_cluster_nearest(
-        'time', duration_seconds, units_time, row_id, col_id, time_nearest_column
-    )
-    time_length = find_same_cluster_length(
-        'time', duration_seconds, units_time, row_id, col_id, time_length_column
-    )
+    # share the positions of each group between the distance and time features
+    groups = {}
 
-    return time_nearest, time_length
+    for feature, source, units in [('distance', distance_radians, units_distance), ('time', duration_seconds, units_time)]:
 
+        feature_ids = [id_column for id_column in id_columns if feature in FEATURES[id_column]]
+        if len(feature_ids) == 0:
+            continue
 
-def get_cluster_summary(details, distance_radians, units_distance, duration_seconds, units_time, column_time):
+        nearest_column = f"Nearest Cluster ({units})"
+        if feature == 'distance':
+            length_column = f"Distance ({units})"
+            indexed = isinstance(source, BallTree)
+        elif feature == 'time':
+            length_column = f"Duration ({units})"
+            indexed = isinstance(source, pd.Series)
 
-    row_id, col_id = matrix_indices(details, 'Cluster ID')
+        for id_column in feature_ids:
+            if id_column not in groups:
+                groups[id_column] = group_index(details, id_column)
 
-    distance_nearest, distance_length = _calc_distance_features(
-        distance_radians, units_distance, row_id, col_id
-    )
-    details[distance_nearest.name] = distance_nearest
-    details[distance_length.name] = distance_length
+        if indexed:
+            nearest = index_next_cluster_nearest(
+                feature, source, units, [groups[id_column] for id_column in feature_ids], nearest_column,
+                neighbors=neighbors
+            )
+            for id_column, id_nearest in zip(feature_ids, nearest):
+                features[id_column][nearest_column] = id_nearest
+                features[id_column][length_column] = index_same_cluster_length(
+                    feature, source, units, groups[id_column], length_column
+                )
+        else:
+            for id_column in feature_ids:
+                features[id_column][nearest_column] = find_next_cluster_nearest(
+                    feature, source, units, groups[id_column], nearest_column, memory_budget
+                )
+                features[id_column][length_column] = find_same_cluster_length(
+                    feature, source, units, groups[id_column], length_column
+                )
 
-    time_nearest, time_length = _calc_time_features(
-        duration_seconds, units_time, row_id, col_id
-    )
-    details[time_nearest.name] = time_nearest
-    details[time_length.name] = time_length   
+    features = {id_column: pd.DataFrame(columns) for id_column, columns in features.items()}
 
-    cluster_groups = details.reset_index().groupby('Cluster ID')
+    return features
+
+
+@performance.timing
+def get_cluster_summary(details, distance_radians, units_distance, duration_seconds, units_time, column_time, features=None):
+
+    if features is None:
+        features = get_features(
+            details, distance_radians, units_distance, duration_seconds, units_time, ['Cluster ID']
+        )
+    distance_nearest, distance_length, time_nearest, time_length = features['Cluster ID'].columns
+
+    for column in features['Cluster ID']:
+        details[column] = features['Cluster ID'][column].values
+
+    cluster_groups = details[details['Cluster ID']>=0].reset_index().groupby('Cluster ID')
     plan = {
         column_time: min,
-        distance_nearest.name: min, distance_length.name: max, 
-        time_nearest.name: min, time_length.name: max
+        distance_nearest: min, distance_length: max, 
+        time_nearest: min, time_length: max
     }
     cluster_summary = cluster_groups.agg(plan)
 
@@ -64,82 +95,92 @@ def get_cluster_summary(details, distance_radians, units_distance, duration_seco
 
     cluster_summary = cluster_summary[[
         '# Points', column_time,
-        distance_nearest.name, distance_length.name, 
-        time_nearest.name, time_length.name
+        distance_nearest, distance_length, 
+        time_nearest, time_length
     ]]
     cluster_summary = cluster_summary.rename(columns={
         column_time: "Time (first)"
     })
 
-    cluster_boundary = cluster_groups.apply(find_location_boundary)
+    cluster_boundary = find_cluster_boundary(details)
 
     return cluster_summary, details, cluster_boundary
 
 
-def get_location_summary(details, distance_radians, units_distance):
+@performance.timing
+def get_location_summary(details, distance_radians, units_distance, features=None):
 
-    row_id, col_id = matrix_indices(details, 'Location ID')
+    if features is None:
+        features = get_features(details, distance_radians, units_distance, None, None, id_columns=['Location ID'])
+    distance_nearest, distance_length = features['Location ID'].columns
 
-    distance_nearest, distance_length = _calc_distance_features(
-        distance_radians, units_distance, row_id, col_id
-    )
     location_summary = details[['Location ID','Cluster ID']].copy()
-    location_summary[distance_nearest.name] = distance_nearest
-    location_summary[distance_length.name] = distance_length
+    for column in features['Location ID']:
+        location_summary[column] = features['Location ID'][column].values
 
-    location_summary = location_summary.groupby('Location ID')
+    location_summary = location_summary[location_summary['Location ID']>=0].groupby('Location ID')
     location_summary = location_summary.agg({
-        'Cluster ID': aggregations.UniqueCountNonNA,
-        distance_nearest.name: 'min',
-        distance_length.name: 'max'
+        distance_nearest: 'min',
+        distance_length: 'max'
     })
-    location_summary = location_summary.rename(columns={'Cluster ID': '# Clusters'})
+    location_summary.insert(0, '# Clusters', count_assigned(details, 'Location ID', 'Cluster ID', location_summary.index))
 
     return location_summary
 
 
-def get_time_summary(details, duration_seconds, units_time):
+@performance.timing
+def get_time_summary(details, duration_seconds, units_time, features=None):
 
-    row_id, col_id = matrix_indices(details, 'Time ID')
+    if features is None:
+        features = get_features(details, None, None, duration_seconds, units_time, ['Time ID'])
+    time_nearest, time_length = features['Time ID'].columns
 
-    time_nearest, time_length = _calc_time_features(
-        duration_seconds, units_time, row_id, col_id
-    )
     time_summary = details[['Time ID', 'Cluster ID']].copy()
-    time_summary[time_nearest.name] = time_nearest
-    time_summary[time_length.name] = time_length
+    for column in features['Time ID']:
+        time_summary[column] = features['Time ID'][column].values
 
-    time_summary = time_summary.groupby('Time ID')
+    time_summary = time_summary[time_summary['Time ID']>=0].groupby('Time ID')
     time_summary = time_summary.agg({
-        'Cluster ID': aggregations.UniqueCountNonNA,
-        time_nearest.name: 'min',
-        time_length.name: 'max'
+        time_nearest: 'min',
+        time_length: 'max'
     })
-    time_summary = time_summary.rename(columns={'Cluster ID': '# Clusters'})
+    time_summary.insert(0, '# Clusters', count_assigned(details, 'Time ID', 'Cluster ID', time_summary.index))
 
     return time_summary
 
 
-def matrix_indices(df, id_column):
+def convert_units(df, units_distance, units_time):
+    '''Convert features from radians and seconds to other units, renaming the columns for the units.'''
+
+    df = df.copy()
+    columns = {}
+    for column in df.columns:
+        if column.endswith(' (radians)'):
+            df[column] = convert.radians_to_distance(df[column], units_distance)
+            columns[column] = column.replace('(radians)', f'({units_distance})')
+        elif column.endswith(' (seconds)'):
+            df[column] = convert.seconds_to_time(df[column], units_time)
+            columns[column] = column.replace('(seconds)', f'({units_time})')
+    df = df.rename(columns=columns)
 
-    grouped = pd.DataFrame(df[id_column])
-    grouped['index'] = range(0, len(grouped))
-    grouped = grouped.groupby(id_column)
-    grouped = grouped.agg({'index': list})
-    grouped['index'] = grouped['index'].apply(lambda x: np.array(x))
-    grouped['row'] = grouped['index'].apply(lambda x: x.repeat(len(x)))
-    grouped['col'] = grouped['index'].apply(lambda x: np.tile(x,len(x)))
-    row_id = np.concatenate(grouped['row'].values)
-    col_id = np.concatenate(grouped['col'].values)
+    return df
 
-    return row_id, col_id
 
+def find_next_cluster_nearest(feature, matrix, units, groups, column_name, memory_budget=None):
 
-def find_next_cluster_nearest(feature, matrix, units, row_id, col_id, column_name):
+    record = _record_group(groups)
+    size = groups['size']
+    nearest = np.empty(size)
+
+    # exclude records of the same group from blocks of rows, which also reads a blocked matrix sequentially
+    rows = calculate.block_rows(size, memory_budget)
+    for start in range(0, size, rows):
+        row = np.arange(start, min(start+rows, size))
+        block = np.asarray(matrix[start:start+rows], dtype=float)
+        same = record[row, None] == record[None, :]
+        nearest[row] = np.where(same, np.inf, block).min(axis=1)
+    nearest[np.isinf(nearest)] = np.nan
 
-    matrix.mask = np.eye(matrix.shape[0], dtype=bool)
-    matrix[row_id, col_id] = ma.masked
-    nearest = matrix.min(axis=0)
     if feature == 'distance':
         nearest = convert.radians_to_distance(nearest, units)
     elif feature == 'time':
@@ -147,16 +188,18 @@ def find_next_cluster_nearest(feature, matrix, units, row_id, col_id, column_nam
 
     nearest =  pd.Series(nearest, name=column_name)
 
-    matrix.mask = False
-
     return nearest
 
 
-def find_same_cluster_length(feature, matrix, units, row_id, col_id, column_name):
+def find_same_cluster_length(feature, matrix, units, groups, column_name):
+
+    length = np.full(groups['size'], np.nan)
+
+    for row, col in _group_pairs(groups, np.ones(len(groups['offset'])-1, dtype=bool)):
+        pair = np.asarray(matrix[row, col], dtype=float)
+        start = np.flatnonzero(np.concatenate([[True], row[1:]!=row[:-1]]))
+        length[row[start]] = np.maximum.reduceat(pair, start)
 
-    matrix.mask = True
-    matrix.mask[row_id, col_id] = False
-    length = matrix.max(axis=0)
     if feature == 'distance':
         length = convert.radians_to_distance(length, units)
     elif feature == 'time':
@@ -164,29 +207,358 @@ def find_same_cluster_length(feature, matrix, units, row_id, col_id, column_name
 
     length = pd.Series(length, name=column_name)
 
-    matrix.mask = False
+    return length
+
+
+def group_index(df, id_column):
+    '''Positions of records with an id sorted by group, along with the offset where each group starts.'''
+
+    labels = df[id_column].to_numpy()
+    assigned = np.flatnonzero(labels>=0)
+    codes = labels[assigned]
+
+    order = assigned[np.argsort(codes, kind='stable')]
+    _, count = np.unique(codes, return_counts=True)
+    offset = np.concatenate([[0], np.cumsum(count)])
+
+    groups = {'size': len(labels), 'order': order, 'offset': offset}
+
+    return groups
+
+
+def _record_group(groups):
+    '''Group of each record, where each record without an id is in a group of its own.'''
+
+    record = -np.arange(1, groups['size']+1)
+    count = np.diff(groups['offset'])
+    record[groups['order']] = np.repeat(np.arange(len(count)), count)
+
+    return record
+
+
+def index_next_cluster_nearest(feature, index, units, groups, column_name, max_neighbors=32, neighbors=None):
+    '''Nearest record in another group for each of the group indexes, sharing the neighbor queries or sort.
+
+    Records of groups larger than max_neighbors skip the neighbor queries and instead query a few trees
+    of the records outside their group, built once for each group index. Precomputed neighbors are
+    searched before querying more.
+    '''
+
+    records = [_record_group(id_groups) for id_groups in groups]
+    size = len(index.data) if feature == 'distance' else len(index)
+
+    if feature == 'distance':
+        coords = np.asarray(index.data)
+        nearest = [np.full(size, np.nan) for _ in records]
+        large = [_large_group(id_groups, max_neighbors) for id_groups in groups]
+        resolved = [label > 0 for label in large]
+
+        # query more neighbors until one is found in a different group, which is certain for the
+        # records of a small group once the neighbors outnumber the group
+        remaining = np.flatnonzero(~np.all(resolved, axis=0))
+        count = 1
+        if neighbors is not None:
+            count = neighbors['neighbor'].shape[1]
+            remaining = _nearest_other(
+                records, nearest, resolved, remaining,
+                neighbors['distance'][remaining], neighbors['neighbor'][remaining]
+            )
+        while len(remaining) > 0 and count < min(max_neighbors+1, size):
+            count = min(count*2, max_neighbors+1, size)
+            if neighbors is None:
+                distance, neighbor = index.query(coords[remaining], k=count)
+            else:
+                chord, neighbor = neighbors['tree'].query(neighbors['unit'][remaining], k=count)
+                distance = convert.chord_to_radians(chord)
+            remaining = _nearest_other(records, nearest, resolved, remaining, distance, neighbor)
+
+        unit = None if neighbors is None else neighbors['unit']
+        for label, id_nearest in zip(large, nearest):
+            member = np.flatnonzero(label > 0)
+            if len(member) > 0:
+                if unit is None:
+                    unit = convert.radians_to_unit(coords)
+                id_nearest[member] = _large_group_nearest(unit, label, member)
+
+        nearest = [convert.radians_to_distance(id_nearest, units) for id_nearest in nearest]
+
+    elif feature == 'time':
+        time = index.view('int64').to_numpy()
+        order = np.argsort(time, kind='stable')
+        time = time[order]
+
+        nearest = []
+        for record in records:
+            record = record[order]
+
+            # in time order, the nearest record of another group is just before or after the run of the same group
+            change = np.flatnonzero(record[1:] != record[:-1]) + 1
+            run_start = np.concatenate([[0], change])
+            run_end = np.concatenate([change, [size]])
+            run_length = run_end - run_start
+            before = np.repeat(run_start - 1, run_length)
+            after = np.repeat(run_end, run_length)
+
+            previous = np.full(size, np.inf)
+            has_before = before >= 0
+            previous[has_before] = (time[has_before] - time[before[has_before]]) / 10**9
+            following = np.full(size, np.inf)
+            has_after = after < size
+            following[has_after] = (time[after[has_after]] - time[has_after]) / 10**9
+
+            id_nearest = np.empty(size)
+            id_nearest[order] = np.minimum(previous, following)
+            id_nearest[np.isinf(id_nearest)] = np.nan
+            nearest += [convert.seconds_to_time(id_nearest, units)]
+
+    nearest = [pd.Series(id_nearest, name=column_name) for id_nearest in nearest]
+
+    return nearest
+
+
+def _nearest_other(records, nearest, resolved, remaining, distance, neighbor):
+    '''Resolve the nearest record of each group index from the sorted neighbors of the remaining records,
+    returning those still unresolved for any index.'''
+
+    for record, id_nearest, id_resolved in zip(records, nearest, resolved):
+        pending = ~id_resolved[remaining]
+        other = record[neighbor[pending]] != record[remaining[pending], None]
+        found = other.any(axis=1)
+        rows = remaining[pending][found]
+        id_nearest[rows] = distance[pending][found, other[found].argmax(axis=1)]
+        id_resolved[rows] = True
+    remaining = remaining[~np.all([id_resolved[remaining] for id_resolved in resolved], axis=0)]
+
+    return remaining
+
+
+def _large_group(groups, max_neighbors):
+    '''Label of each record numbering the groups larger than max_neighbors from 1, and 0 for other records.'''
+
+    count = np.diff(groups['offset'])
+    group_label = np.zeros(len(count), dtype='int64')
+    large = count > max_neighbors
+    group_label[large] = np.arange(1, large.sum()+1)
+
+    label = np.zeros(groups['size'], dtype='int64')
+    label[groups['order']] = np.repeat(group_label, count)
+
+    return label
+
+
+def _large_group_nearest(unit, label, member):
+    '''Nearest record outside the large group of each member, from a tree of the records outside any large group
+    and, for each bit of the labels, trees of the large group records with the bit unset or set.
+
+    Any other large group differs from the group of a member in at least one bit of the label. Trees are of
+    unit vectors.
+    '''
+
+    nearest = np.full(len(member), np.inf)
+
+    candidates = [(label==0, np.ones(len(member), dtype=bool))]
+    for bit in range(int(label.max()).bit_length()):
+        value = (label >> bit) & 1
+        for setting in [0, 1]:
+            candidates += [((label>0) & (value==setting), value[member]!=setting)]
+
+    for points, query in candidates:
+        if points.any() and query.any():
+            chord, _ = KDTree(unit[points]).query(unit[member[query]], k=1)
+            nearest[query] = np.minimum(nearest[query], chord[:, 0])
+    nearest[np.isinf(nearest)] = np.nan
+    nearest = convert.chord_to_radians(nearest)
+
+    return nearest
+
+
+def index_same_cluster_length(feature, index, units, groups, column_name, hull_size=64):
+
+    length = np.full(groups['size'], np.nan)
+    count = np.diff(groups['offset'])
+
+    if feature == 'distance':
+        coords = np.asarray(index.data)
+
+        # pairwise maximum within small groups
+        small = count <= hull_size
+        for row, col in _group_pairs(groups, small):
+            pair = calculate.pair_radians(coords[row], coords[col])
+            start = np.flatnonzero(np.concatenate([[True], row[1:]!=row[:-1]]))
+            length[row[start]] = np.maximum.reduceat(pair, start)
+
+        # the farthest record within a large group is a vertex of the group's convex hull
+        for start, end in zip(groups['offset'][:-1][~small], groups['offset'][1:][~small]):
+            member = groups['order'][start:end]
+            try:
+                vertices = member[ConvexHull(coords[member]).vertices]
+            except QhullError:
+                vertices = member
+            block_size = max(2**22 // len(vertices), 1)
+            for block in range(0, len(member), block_size):
+                rows = member[block:block+block_size]
+                length[rows] = haversine_distances(coords[rows], coords[vertices]).max(axis=1)
+
+        length = convert.radians_to_distance(length, units)
+
+    elif feature == 'time':
+        time = index.view('int64').to_numpy()
+
+        # the farthest record within a group is either the first or last in time
+        grouped = time[groups['order']]
+        if len(grouped) > 0:
+            first = np.repeat(np.minimum.reduceat(grouped, groups['offset'][:-1]), count)
+            last = np.repeat(np.maximum.reduceat(grouped, groups['offset'][:-1]), count)
+            length[groups['order']] = np.maximum(grouped - first, last - grouped) / 10**9
+
+        length = convert.seconds_to_time(length, units)
+
+    length = pd.Series(length, name=column_name)
 
     return length
 
 
-def find_location_boundary(group):
-    '''Calculate the boundary of latitude and longitude points using a convex hull.'''
+def _group_pairs(groups, select, block_size=2**22):
+    '''Blocks of positions for every pair of records within the selected groups, ordered by the first record.'''
+
+    count = np.diff(groups['offset'])[select]
+    start = groups['offset'][:-1][select]
+
+    # split groups into pieces of whole rows so that a large group spans several blocks
+    rows = np.maximum(block_size // np.maximum(count, 1), 1)
+    pieces = -(-count // rows)
+    piece_group = np.repeat(np.arange(len(count)), pieces)
+    piece_row = (np.arange(pieces.sum()) - np.repeat(np.cumsum(pieces) - pieces, pieces)) * rows[piece_group]
+    piece_pairs = np.minimum(rows[piece_group], count[piece_group] - piece_row) * count[piece_group]
+
+    # combine pieces into blocks of about block_size pairs
+    block = (np.cumsum(piece_pairs) - piece_pairs) // block_size
+    for value in np.unique(block):
+        piece = block==value
+        pairs = piece_pairs[piece]
+        size = np.repeat(count[piece_group[piece]], pairs)
+        first = np.repeat(start[piece_group[piece]], pairs)
+        first_row = np.repeat(piece_row[piece], pairs)
+        offset = np.arange(pairs.sum()) - np.repeat(np.cumsum(pairs) - pairs, pairs)
+
+        row = groups['order'][first + first_row + offset // size]
+        col = groups['order'][first + offset % size]
+
+        yield row, col
+
+
+def count_assigned(details, id_column, count_column, index):
+    '''Number of assigned ids of a column for each id, without a python function for each group.'''
+
+    assigned = details.loc[details[id_column]>=0, [id_column, count_column]]
+    assigned = assigned[assigned[count_column]>=0].drop_duplicates()
+    count = assigned.groupby(id_column).size().reindex(index, fill_value=0)
+
+    return count
 
-    points = group[['_latitude_mercator','_longitude_mercator']].values
+
+@performance.timing
+def find_cluster_boundary(details, hull_size=64):
+    '''Boundary of the mercator points of each Cluster ID.
+
+    Groups of up to hull_size points are wrapped together, since a ConvexHull for each of many small
+    groups is dominated by its overhead.
+    '''
+
+    groups = group_index(details, 'Cluster ID')
+    points = details[['_latitude_mercator','_longitude_mercator']].to_numpy()[groups['order']]
+    count = np.diff(groups['offset'])
+    start = groups['offset'][:-1]
+
+    boundary = [points[first:first+size] for first, size in zip(start, count)]
+
+    # pad groups to a few sizes with repeats of their last point, which don't change the hull
+    small = np.flatnonzero((count>2) & (count<=hull_size))
+    padded = 2**np.ceil(np.log2(count[small])).astype(int)
+    for size in np.unique(padded):
+        selected = small[padded==size]
+        position = start[selected, None] + np.minimum(np.arange(size), count[selected, None]-1)
+        vertices, num_vertices = _gift_wrap(points[position])
+        for index, group_vertices, num in zip(selected, vertices, num_vertices):
+            group_points = boundary[index]
+            if num > 2:
+                # enclose the hull boundary
+                boundary[index] = group_points[np.append(group_vertices[:num], group_vertices[0])]
+            else:
+                # a line between the ends of duplicate or collinear points
+                boundary[index] = np.unique(group_points, axis=0)[[0,-1]]
+
+    for index in np.flatnonzero(count>hull_size):
+        boundary[index] = find_location_boundary(boundary[index])
+
+    # format for multi_polygons
+    # ex) LAT_mercator = [[[[0, 0, 1, 1]]], [[[3,4,5]]]]
+    index = pd.Index(np.unique(details.loc[details['Cluster ID']>=0, 'Cluster ID']), name='Cluster ID')
+    cluster_boundary = pd.DataFrame({
+        '_latitude_mercator': [[[group_boundary[:,0].tolist()]] for group_boundary in boundary],
+        '_longitude_mercator': [[[group_boundary[:,1].tolist()]] for group_boundary in boundary]
+    }, index=index)
+
+    return cluster_boundary
+
+
+def _gift_wrap(points):
+    '''Convex hull vertices of groups of the same number of points, wrapping every group at once.
+
+    Vertices are positions within each group, counterclockwise from the lowest point, along with the
+    number of vertices of each group.
+    '''
+
+    size, num_points, _ = points.shape
+    rows = np.arange(size)
+
+    # the lowest, then leftmost, point is always a vertex
+    latitude, longitude = points[..., 0], points[..., 1]
+    lowest = latitude == latitude.min(axis=1, keepdims=True)
+    first = np.where(lowest, longitude, np.inf).argmin(axis=1)
+
+    vertices = np.zeros((size, num_points), dtype=int)
+    num_vertices = np.zeros(size, dtype=int)
+    current = first
+    wrapping = np.ones(size, dtype=bool)
+    for step in range(num_points):
+        vertices[wrapping, step] = current[wrapping]
+        num_vertices += wrapping
+
+        # the next vertex has no point to its right, or is the farthest of those in line
+        origin = points[rows, current]
+        candidate = (current+1) % num_points
+        for other in range(num_points):
+            edge = points[rows, candidate] - origin
+            offset = points[:, other] - origin
+            cross = edge[:, 0]*offset[:, 1] - edge[:, 1]*offset[:, 0]
+            farther = (offset**2).sum(axis=1) > (edge**2).sum(axis=1)
+            candidate = np.where((cross<0) | ((cross==0) & farther), other, candidate)
+        current = candidate
+
+        wrapping &= (points[rows, current] != points[rows, first]).any(axis=1)
+        if not wrapping.any():
+            break
+
+    return vertices, num_vertices
+
+
+def find_location_boundary(points):
+    '''Calculate the boundary of latitude and longitude points using a convex hull.'''
 
     # return a line for only 2 points
     if points.shape[0]<=2:
         boundary = points
     # return hull for >2 points
     else:
-        hull = ConvexHull(points)
-        boundary = points[hull.vertices]
-        # enclose the hull boundary
-        boundary = np.concatenate([boundary,boundary[[0],:]])
-
-    # reshape and format for multi_polygons
-    # ex) LAT_mercator = [[[[0, 0, 1, 1]]], [[[3,4,5]]]]
-    boundary = pd.Series({'_latitude_mercator': [[list(boundary[:,0])]], '_longitude_mercator': [[list(boundary[:,1])]]})
+        try:
+            hull = ConvexHull(points)
+            boundary = points[hull.vertices]
+            # enclose the hull boundary
+            boundary = np.concatenate([boundary,boundary[[0],:]])
+        # return a line between the ends of duplicate or collinear points
+        except QhullError:
+            boundary = np.unique(points, axis=0)[[0,-1]]
 
     return boundary
 
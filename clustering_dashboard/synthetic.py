@@ -0,0 +1,207 @@
+# python -m clustering_dashboard.synthetic records.parquet --size 1000000 --seed 0 --row-group-size 100000
+
+import argparse
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from clustering_dashboard import convert, group
+
+# fraction of records planted in each kind of group
+FRACTIONS = {'joint': 0.4, 'location': 0.2, 'time': 0.2, 'noise': 0.2}
+COLUMNS = {'id': 'TripID', 'latitude': 'Latitude', 'longitude': 'Longitude', 'time': 'Pickup Time'}
+
+
+def generate(
+    size, seed=0, distance_threshold=0.25, distance_units='miles', time_threshold=5, time_units='minutes',
+    fractions=None, max_group=8, duplicate_fraction=0.1, start='2010-01-01', hours=(6, 22), center=(40.75, -73.98)
+):
+    '''Records sorted by time with planted clusters, and the Location, Time and Cluster ID expected for the thresholds.
+
+    Each record is at a site and in a time slot. Records at the same site are within half the distance
+    threshold of each other and sites are at least four thresholds apart, so a Location ID is a site.
+    Likewise slots are half the time threshold long and at least one and a half thresholds apart, only
+    within the hours of each day, so a Time ID is a slot and a Cluster ID is a site and slot.
+
+    Joint groups share a site and slot, location groups share only a site, time groups share only a slot
+    and noise shares neither. Some records of joint and location groups duplicate the coordinates of the
+    first record of the group.
+    '''
+
+    fractions = pd.Series(FRACTIONS if fractions is None else fractions, dtype=float)
+    if not set(fractions.index) <= set(FRACTIONS) or (fractions < 0).any() or fractions.sum() <= 0:
+        raise RuntimeError(f'Invalid fractions, expected non-negative values for {list(FRACTIONS)}.')
+    if max_group < 2:
+        raise RuntimeError('Invalid max_group, groups require at least 2 records.')
+
+    rng = np.random.default_rng(seed)
+    max_radians = convert.distance_to_radians(distance_threshold, distance_units)
+    max_seconds = convert.time_to_seconds(time_threshold, time_units)
+
+    # kind and size of each group, noise being groups of one record
+    kinds = list(fractions.index)
+    counts = np.floor(fractions / fractions.sum() * size).astype('int64')
+    counts.iloc[np.argmax(fractions.values)] += size - counts.sum()
+    kind, length = [], []
+    for name, count in counts.items():
+        if name == 'noise':
+            sizes = np.ones(count, dtype='int64')
+        else:
+            sizes = _group_sizes(rng, count, max_group)
+        kind += [np.full(len(sizes), kinds.index(name))]
+        length += [sizes]
+    kind = np.concatenate(kind)
+    length = np.concatenate(length)
+    order = rng.permutation(len(kind))
+    kind, length = kind[order], length[order]
+
+    # group and position within the group of each record
+    record_group = np.repeat(np.arange(len(kind)), length)
+    record_kind = np.array(kinds)[kind][record_group]
+    first = np.concatenate([[0], np.cumsum(length)[:-1]])
+    position = np.arange(size) - first[record_group]
+
+    # records of a group share a site unless it is a time group, and share a slot unless it is a location group
+    share_site = record_kind != 'time'
+    share_slot = record_kind != 'location'
+    site = _shared_index(record_group, share_site)
+    slot = _shared_index(record_group, share_slot)
+    site = rng.permutation(site.max()+1)[site]
+    slot = rng.permutation(slot.max()+1)[slot]
+
+    latitude, longitude = _site_coordinates(rng, site, max_radians, center)
+    seconds = _slot_seconds(rng, slot, max_seconds, hours)
+
+    # duplicate the coordinates of the first record of the group
+    duplicate = share_site & (position > 0) & (rng.random(size) < duplicate_fraction)
+    source = first[record_group[duplicate]]
+    latitude[duplicate] = latitude[source]
+    longitude[duplicate] = longitude[source]
+
+    records = pd.DataFrame({
+        COLUMNS['id']: np.arange(size),
+        COLUMNS['latitude']: latitude,
+        COLUMNS['longitude']: longitude,
+        COLUMNS['time']: pd.Timestamp(start) + pd.to_timedelta(np.round(seconds*1000).astype('int64'), unit='ms'),
+        'Fare Amount': np.round(rng.gamma(2, 5, size), 2),
+        'Kind': record_kind
+    })
+    order = np.argsort(records[COLUMNS['time']].to_numpy(), kind='stable')
+    records = records.iloc[order].reset_index(drop=True)
+    records[COLUMNS['id']] = np.arange(size)
+
+    # ids numbered as the records are labeled once sorted by time
+    labels = pd.DataFrame({
+        COLUMNS['id']: records[COLUMNS['id']],
+        'Location ID': group._rank_labels(group._first_appearance(site[order])).values,
+        'Time ID': group._rank_labels(group._first_appearance(slot[order])).values,
+        'Cluster ID': group._rank_labels(group._first_appearance(site[order]*(slot.max()+1)+slot[order])).values
+    })
+
+    return records, labels
+
+
+def write(path, size, row_group_size=None, **kwargs):
+    '''Write generated records as parquet and the expected ids next to them, returning both paths.'''
+
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path_labels = path.with_name(f'{path.stem}_labels{path.suffix}')
+
+    records, labels = generate(size, **kwargs)
+    records.to_parquet(path, index=False, row_group_size=row_group_size)
+    labels.to_parquet(path_labels, index=False, row_group_size=row_group_size)
+
+    return path, path_labels
+
+
+def _group_sizes(rng, count, max_group):
+    '''Sizes between 2 and max_group records, totaling count with any remaining record as a group of one.'''
+
+    sizes = rng.integers(2, max_group+1, size=count//2+1)
+    total = np.cumsum(sizes)
+    sizes = sizes[total <= count]
+    remaining = count - sizes.sum()
+    if remaining > 0:
+        sizes = np.append(sizes, remaining)
+
+    return sizes
+
+
+def _shared_index(record_group, share):
+    '''Index of the site or slot of each record, shared by the records of a group when share is True.'''
+
+    key = np.where(share, -1, np.arange(len(record_group)))
+    _, index = np.unique(np.column_stack([record_group, key]), axis=0, return_inverse=True)
+
+    return index.reshape(-1)
+
+
+def _site_coordinates(rng, site, max_radians, center):
+    '''Sites on a grid spaced four thresholds apart, with records within a quarter threshold of the site.'''
+
+    spacing = 4 * max_radians
+    side = int(np.ceil(np.sqrt(site.max()+1)))
+    row, col = np.divmod(site, side)
+
+    latitude = np.radians(center[0]) + (row - side/2) * spacing
+    if np.abs(latitude).max() + spacing > np.radians(80):
+        raise RuntimeError('Invalid size, sites for the distance threshold extend beyond 80 degrees latitude.')
+    # widen longitude for the largest latitude so sites are at least the spacing apart
+    spacing_longitude = spacing / np.cos(np.abs(latitude).max() + spacing)
+    longitude = np.radians(center[1]) + (col - side/2) * spacing_longitude
+
+    radius = rng.uniform(0, max_radians/4, len(site))
+    angle = rng.uniform(0, 2*np.pi, len(site))
+    latitude = latitude + radius*np.cos(angle)
+    longitude = longitude + radius*np.sin(angle)/np.cos(latitude)
+
+    return np.degrees(latitude), np.degrees(longitude)
+
+
+def _slot_seconds(rng, slot, max_seconds, hours):
+    '''Seconds from the start for slots two thresholds apart within the hours of each day, with records within half a threshold.'''
+
+    pitch = 2 * max_seconds
+    per_day = int((hours[1] - hours[0]) * 3600 // pitch)
+    if per_day < 1:
+        raise RuntimeError('Invalid hours, each day requires room for a slot of the time threshold.')
+
+    day, within = np.divmod(slot, per_day)
+    seconds = day*24*3600 + hours[0]*3600 + within*pitch + rng.uniform(0, max_seconds/2, len(slot))
+
+    return seconds
+
+
+def parse_args(args=None):
+
+    parser = argparse.ArgumentParser(
+        prog='python -m clustering_dashboard.synthetic',
+        description='Generate records with planted clusters, and their expected ids, as parquet.'
+    )
+    parser.add_argument('output', help='parquet file of records, with the expected ids written to *_labels.parquet')
+    parser.add_argument('--size', type=int, required=True, help='number of records')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--row-group-size', type=int, default=None, help='records in each parquet row group')
+    parser.add_argument('--distance-units', default='miles', choices=['miles', 'feet', 'kilometers'])
+    parser.add_argument('--distance-threshold', type=float, default=0.25)
+    parser.add_argument('--time-units', default='minutes', choices=['days', 'hours', 'minutes'])
+    parser.add_argument('--time-threshold', type=float, default=5)
+
+    return parser.parse_args(args)
+
+
+def main(args=None):
+
+    args = parse_args(args)
+
+    write(
+        args.output, args.size, args.row_group_size, seed=args.seed,
+        distance_threshold=args.distance_threshold, distance_units=args.distance_units,
+        time_threshold=args.time_threshold, time_units=args.time_units
+    )
+
+
+if __name__ == '__main__':
+    main()
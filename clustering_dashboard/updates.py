@@ -1,15 +1,22 @@
 import pandas as pd
 import numpy as np
+from bokeh.core.property.validation import validate
+from bokeh.models import ColumnDataSource
 
-from clustering_dashboard import calculate
+from clustering_dashboard import aggregations, convert, performance
+from clustering_dashboard.summary import convert_units
+from clustering_dashboard.engine import engine
 
-class updates():
+class updates(engine):
 
     def __init__(self):
         
         self.selected_details = self.details
+        # summary and units shown by each table
+        self.displayed_summary = {}
 
 
+    @performance.profiled
     def update_map(self):
 
         # variable field names
@@ -18,7 +25,7 @@ class updates():
         latitude = self.columns['latitude']
 
         # only plot clusters with assigned ID
-        assigned_clusters = self.selected_details.dropna(subset=['Cluster ID']).copy()
+        assigned_clusters = self.selected_details[self.selected_details['Cluster ID']>=0]
 
         # update boundary box of each cluster
         unique_clusters = assigned_clusters['Cluster ID'].drop_duplicates()
@@ -32,9 +39,9 @@ class updates():
 
         # update points
         self.render_points.data_source.data = {
-            'Cluster ID': assigned_clusters['Cluster ID'].fillna(-1).values,
-            'Location ID': assigned_clusters['Location ID'].fillna(-1).values,
-            'Time ID': assigned_clusters['Time ID'].fillna(-1).values,
+            'Cluster ID': assigned_clusters['Cluster ID'].values,
+            'Location ID': assigned_clusters['Location ID'].values,
+            'Time ID': assigned_clusters['Time ID'].values,
             'xs': assigned_clusters['_longitude_mercator'].values,
             'ys': assigned_clusters['_latitude_mercator'].values,
             self.columns['id']: assigned_clusters[self.columns['id']].values,
@@ -59,56 +66,71 @@ class updates():
     def update_detail(self):
 
         name = [col.field for col in self.table_detail.columns]
-        data = self.selected_details[name].copy()
-        id_cols = ['Cluster ID', 'Location ID', 'Time ID']
-        data[id_cols] = data[id_cols].fillna(-1)
-            
-        self.source_detail.data = data
+        data = self.selected_details[name]
+
+        # a dictionary avoids bokeh formatting the frame when validating
+        self.source_detail.data = ColumnDataSource.from_df(data)
         self.update_selected_count()
 
 
     def update_evaluation(self):
 
+        cluster_summary = convert_units(self.cluster_summary, self.units['distance'].value, self.units['time'].value)
+
         self._histogram_evaluation(
-            f"Nearest Cluster ({self.units['distance'].value})",
+            cluster_summary[f"Nearest Cluster ({self.units['distance'].value})"],
             self.render_next_distance
         )
         
         self._histogram_evaluation(
-            f"Distance ({self.units['distance'].value})",
+            cluster_summary[f"Distance ({self.units['distance'].value})"],
             self.render_span_distance
         )
 
         self._histogram_evaluation(
-            f"Nearest Cluster ({self.units['time'].value})",
+            cluster_summary[f"Nearest Cluster ({self.units['time'].value})"],
             self.render_next_date
         )
 
         self._histogram_evaluation(
-            f"Duration ({self.units['time'].value})",
+            cluster_summary[f"Duration ({self.units['time'].value})"],
             self.render_span_date
         )
 
 
     def update_summary(self, summary, source, id_name, indices_highlight=[], indices_filter=[]):
 
+        # only change the highlight if the table already shows the summary
+        if len(indices_filter)==0 and self._displayed(summary, id_name):
+            highlighted = np.flatnonzero(np.asarray(source.data['_selected_color'])!='null')
+            # the patch is valid so avoid validating every value of the table
+            with validate(False):
+                source.patch({'_selected_color':
+                    [(int(index), 'null') for index in highlighted] + [(int(index), '#ee4729') for index in indices_highlight]
+                })
+            return summary
+
         # filter for selected clusters only if needed
         if len(indices_filter)>0:
             summary = summary[
                 summary.index.isin(indices_filter)
             ].copy()
 
+        # summaries are in radians and seconds until displayed
+        display = convert_units(summary, self.units['distance'].value, self.units['time'].value)
+
         # replace values of all empty to avoid ValueError: Out of range float values are not JSON compliant
-        all_empty = summary.columns[summary.isna().all()]
-        summary[all_empty] = '-'
+        all_empty = display.columns[display.isna().all()]
+        display[all_empty] = '-'
 
         # highlight id of selected
-        summary['_selected_color'] = 'null'
+        display['_selected_color'] = 'null'
         if len(indices_highlight)>0:
-            summary.iloc[indices_highlight, -1] = '#ee4729'
+            display.iloc[indices_highlight, -1] = '#ee4729'
 
-        # update the table
-        source.data = summary.reset_index().copy().to_dict(orient='list')
+        # update the table, with arrays to limit the objects held by the source
+        source.data = {column: values.to_numpy() for column, values in display.reset_index().items()}
+        self.displayed_summary[id_name] = (summary, self.units['distance'].value, self.units['time'].value)
 
         return summary
 
@@ -118,17 +140,17 @@ class updates():
         parameters = {
             'distance_radians': {
                 'renderer': self.render_estimate_distance,
-                'data': calculate.nearest_point(self.distance_radians, self.units["distance"].value)
+                'data': convert.radians_to_distance(self.estimate['distance'], self.units["distance"].value)
             },
             'time': {
                 'renderer': self.render_estimate_time,
-                'data': calculate.nearest_time(self.details[self.columns['time']], self.units["time"].value)
+                'data': convert.seconds_to_time(self.estimate['time'], self.units["time"].value)
             }
         }
 
         for target in parameters.values():
 
-            values = target['data'].sort_values()
+            values = target['data']
             
             source = {
                 'x': range(0, len(values)),
@@ -137,18 +159,33 @@ class updates():
             target['renderer'].data_source.data = source
 
 
+    def update_diagnostics(self):
+
+        self.source_diagnostics.data = performance.metrics.to_frame().reset_index().to_dict(orient='list')
+
+
     def update_selected_count(self):
 
-        num_clusters = self.selected_details['Cluster ID'].dropna().nunique()
+        num_clusters = aggregations.UniqueCountAssigned(self.selected_details['Cluster ID'])
         self.count_summary.text = f"({num_clusters} selected)"
 
-        num_locations = self.selected_details['Location ID'].dropna().nunique()
+        num_locations = aggregations.UniqueCountAssigned(self.selected_details['Location ID'])
         self.count_location.text = f"({num_locations} selected)"
 
-        num_times = self.selected_details['Time ID'].dropna().nunique()
+        num_times = aggregations.UniqueCountAssigned(self.selected_details['Time ID'])
         self.count_time.text = f"({num_times} selected)"
 
 
+    def _displayed(self, summary, id_name):
+        '''Whether a table shows a summary in the current units.'''
+
+        if id_name not in self.displayed_summary:
+            return False
+        displayed, units_distance, units_time = self.displayed_summary[id_name]
+
+        return displayed is summary and (units_distance, units_time) == (self.units['distance'].value, self.units['time'].value)
+
+
     def _zoom_window(self, df):
         '''Calculate a square zoom window using mercator x and y points.'''
 
@@ -162,9 +199,7 @@ class updates():
         return zoom
 
 
-    def _histogram_evaluation(self, column, renderer):
-
-        data = self.cluster_summary[column]
+    def _histogram_evaluation(self, data, renderer):
 
         hist, edges = np.histogram(data.dropna(), bins='fd')
 
@@ -0,0 +1,48 @@
+import json
+from pathlib import Path
+import sys
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / 'benchmarks'))
+
+import benchmark
+
+
+def test_regressions():
+
+    baseline = {
+        'get_clusters': {
+            '1000': {'seconds': 0.01, 'peak_bytes': 2**20},
+            '10000': {'seconds': 1.0, 'peak_bytes': 2**28}
+        }
+    }
+    results = {
+        'get_clusters': {
+            # several times slower and larger, but by less than the floors
+            '1000': {'seconds': 0.04, 'peak_bytes': 2**22},
+            '10000': {'seconds': 1.5, 'peak_bytes': 2**29},
+            '100000': {'seconds': 100.0, 'peak_bytes': 2**33}
+        },
+        'get_features': {'1000': {'seconds': 1.0, 'peak_bytes': 2**30}}
+    }
+
+    flagged = benchmark.regressions(results, baseline, 0.25)
+    assert [(regression['size'], regression['metric'], regression['ratio']) for regression in flagged] == [
+        (10000, 'seconds', 1.5), (10000, 'peak_bytes', 2.0)
+    ]
+
+    flagged = benchmark.regressions(results, baseline, 0.25, min_seconds=0.01, min_bytes=2**20)
+    assert [(regression['size'], regression['metric']) for regression in flagged] == [
+        (1000, 'seconds'), (1000, 'peak_bytes'), (10000, 'seconds'), (10000, 'peak_bytes')
+    ]
+
+    assert benchmark.regressions(results, baseline, 1.0) == []
+
+
+def test_baseline():
+
+    baseline = json.loads((Path(__file__).resolve().parents[1] / 'benchmarks' / 'baseline.json').read_text())
+
+    assert set(baseline) == set(benchmark.STAGES)
+    for sizes in baseline.values():
+        for result in sizes.values():
+            assert set(result) == {'seconds', 'peak_bytes'}
@@ -0,0 +1,134 @@
+import json
+import subprocess
+import sys
+
+import pandas as pd
+import pytest
+
+from clustering_dashboard import cli, ingest
+
+import data
+
+
+def test_cli(tmp_path):
+
+    data.df.to_parquet(tmp_path / 'records.parquet')
+
+    cli.main([
+        str(tmp_path / 'records.parquet'), str(tmp_path / 'output'),
+        '--id', 'TripID', '--latitude', 'Latitude', '--longitude', 'Longitude', '--time', 'Pickup Time',
+        '--distance-units', 'miles', '--distance-threshold', '0.25',
+        '--time-units', 'minutes', '--time-threshold', '5',
+        '--metrics', str(tmp_path / 'metrics.json')
+    ])
+
+    details = pd.read_parquet(tmp_path / 'output' / 'details.parquet')
+    assert len(details) == len(data.df)
+    assert 'engine.cluster_result' in json.loads((tmp_path / 'metrics.json').read_text())
+    assert not details.columns.str.startswith('_').any()
+    for name, id_column in [('location', 'Location ID'), ('time', 'Time ID'), ('cluster', 'Cluster ID')]:
+        summary = pd.read_parquet(tmp_path / 'output' / f'{name}_summary.parquet')
+        assert summary.index.name == id_column
+        assert set(summary.index) == set(details.loc[details[id_column]>=0, id_column])
+
+
+def test_cli_headless():
+
+    code = 'import sys, clustering_dashboard.cli; print(any(name.startswith("bokeh") for name in sys.modules))'
+    result = subprocess.run([sys.executable, '-c', code], capture_output=True, text=True, check=True)
+
+    assert result.stdout.strip() == 'False'
+
+
+def test_cli_csv(tmp_path):
+
+    data.df.to_csv(tmp_path / 'records.csv')
+
+    cli.main([
+        str(tmp_path / 'records.csv'), str(tmp_path / 'output'),
+        '--id', 'TripID', '--latitude', 'Latitude', '--longitude', 'Longitude', '--time', 'Pickup Time',
+        '--detail-columns', 'Fare Amount',
+        '--distance-units', 'miles', '--distance-threshold', '0.25',
+        '--time-units', 'minutes', '--time-threshold', '5'
+    ])
+
+    details = pd.read_parquet(tmp_path / 'output' / 'details.parquet')
+    assert details.columns[:5].tolist() == ['TripID', 'Latitude', 'Longitude', 'Pickup Time', 'Fare Amount']
+    assert pd.api.types.is_datetime64_any_dtype(details['Pickup Time'])
+
+    summary = pd.read_parquet(tmp_path / 'output' / 'cluster_summary.parquet')
+    assert set(summary.index) == set(details.loc[details['Cluster ID']>=0, 'Cluster ID'])
+    assert 'Distance (miles)' in summary.columns and 'Duration (minutes)' in summary.columns
+
+
+@pytest.mark.parametrize('time_format', ['%m/%d/%Y %H:%M', '%Y-%m-%d %H:%M:%S+05:00'])
+def test_cli_csv_time_format(tmp_path, time_format):
+
+    records = data.df.assign(**{'Pickup Time': data.df['Pickup Time'].dt.strftime(time_format)})
+    records.to_csv(tmp_path / 'records.csv')
+
+    cli.main([
+        str(tmp_path / 'records.csv'), str(tmp_path / 'output'),
+        '--id', 'TripID', '--latitude', 'Latitude', '--longitude', 'Longitude', '--time', 'Pickup Time',
+        '--distance-units', 'miles', '--distance-threshold', '0.25',
+        '--time-units', 'minutes', '--time-threshold', '5'
+    ])
+
+    # parsed as pandas parses the text
+    details = pd.read_parquet(tmp_path / 'output' / 'details.parquet')
+    expected = pd.to_datetime(records['Pickup Time']).sort_values(kind='stable', ignore_index=True)
+    assert details['Pickup Time'].reset_index(drop=True).equals(expected.rename('Pickup Time'))
+
+
+def test_read_csv_time(tmp_path):
+
+    data.df.to_csv(tmp_path / 'records.csv', index=False)
+    details = ingest.read_records(tmp_path / 'records.csv', 'csv', column_time='Pickup Time')
+    assert details['Pickup Time'].dtype == 'datetime64[ns]'
+    assert details['Pickup Time'].equals(data.df['Pickup Time'].reset_index(drop=True))
+
+    # other formats are kept as text for pandas
+    records = data.df.assign(**{'Pickup Time': data.df['Pickup Time'].dt.strftime('%m/%d/%Y %H:%M')})
+    records.to_csv(tmp_path / 'records.csv', index=False)
+    details = ingest.read_records(tmp_path / 'records.csv', 'csv', column_time='Pickup Time')
+    assert details['Pickup Time'].equals(records['Pickup Time'].reset_index(drop=True))
+
+
+def test_cli_tiled(tmp_path):
+
+    data.df.to_parquet(tmp_path / 'records.parquet')
+
+    arguments = [
+        str(tmp_path / 'records.parquet'),
+        '--id', 'TripID', '--latitude', 'Latitude', '--longitude', 'Longitude', '--time', 'Pickup Time',
+        '--distance-units', 'miles', '--distance-threshold', '0.25',
+        '--time-units', 'minutes', '--time-threshold', '5'
+    ]
+    cli.main(arguments[:1] + [str(tmp_path / 'graph')] + arguments[1:])
+    cli.main(arguments[:1] + [str(tmp_path / 'tiled')] + arguments[1:] + ['--tiled', '--workers', '2'])
+
+    pd.testing.assert_frame_equal(
+        pd.read_parquet(tmp_path / 'tiled' / 'details.parquet'),
+        pd.read_parquet(tmp_path / 'graph' / 'details.parquet')
+    )
+
+
+def test_cli_memory_budget(tmp_path):
+
+    data.df.to_parquet(tmp_path / 'records.parquet')
+
+    arguments = [
+        str(tmp_path / 'records.parquet'),
+        '--id', 'TripID', '--latitude', 'Latitude', '--longitude', 'Longitude', '--time', 'Pickup Time',
+        '--distance-units', 'miles', '--distance-threshold', '0.25',
+        '--time-units', 'minutes', '--time-threshold', '5'
+    ]
+    cli.main(arguments[:1] + [str(tmp_path / 'graph')] + arguments[1:])
+    # a budget of a few rows per block
+    cli.main(arguments[:1] + [str(tmp_path / 'blocked')] + arguments[1:] + ['--memory-budget', str(3*len(data.df)*8*4)])
+
+    for name in ['details', 'location_summary', 'time_summary', 'cluster_summary']:
+        pd.testing.assert_frame_equal(
+            pd.read_parquet(tmp_path / 'blocked' / f'{name}.parquet'),
+            pd.read_parquet(tmp_path / 'graph' / f'{name}.parquet')
+        )
@@ -1,7 +1,10 @@
+import tracemalloc
+
+import numpy as np
 import pandas as pd
 import pytest
 
-from clustering_dashboard import calculate, group
+from clustering_dashboard import aggregations, calculate, group, convert, summary, synthetic
 
 import data
 
@@ -20,9 +23,9 @@ def sample():
         'time': 5
     }
     labels = {
-        'Location ID': pd.Series([0,0,pd.NA,pd.NA,0,0,pd.NA,0,1,1], dtype='Int64'),
-        'Time ID': pd.Series([0,0,pd.NA,1,1,1,1,0,0,0], dtype='Int64'),
-        'Cluster ID': pd.Series([0,0,pd.NA,pd.NA,1,1,pd.NA,0,2,2], dtype='Int64')
+        'Location ID': pd.Series([0,0,-1,-1,0,0,-1,0,1,1], dtype='int32'),
+        'Time ID': pd.Series([0,0,-1,1,1,1,1,0,0,0], dtype='int32'),
+        'Cluster ID': pd.Series([0,0,-1,-1,1,1,-1,0,2,2], dtype='int32')
     }
 
     yield {'data': df, 'units': units, 'thresholds': thresholds, 'labels': labels}
@@ -63,4 +66,337 @@ def test_multifeature(sample):
 
     cluster_label = group.assign_id([distance_criteria, time_criteria])
 
-    assert cluster_label.equals(sample['labels']['Cluster ID'])
\ No newline at end of file
+    assert cluster_label.equals(sample['labels']['Cluster ID'])
+
+def test_distance_sparse(sample):
+
+    distance_radians = calculate.distance_matrix(sample['data'], 'Latitude', 'Longitude')
+    distance_dense = group.compare_distance(distance_radians, sample['units']['distance'], sample['thresholds']['distance'])
+
+    max_radians = convert.distance_to_radians(sample['thresholds']['distance'], sample['units']['distance'])
+    distance_graph = calculate.distance_graph(sample['data'], 'Latitude', 'Longitude', max_radians)
+    distance_sparse = group.compare_distance(distance_graph, sample['units']['distance'], sample['thresholds']['distance'])
+
+    # stored pairs match the dense matrix within the maximum radius
+    row, col = distance_graph.nonzero()
+    assert np.allclose(distance_graph[row, col].A1, np.array(distance_radians)[row, col])
+    assert (distance_sparse.toarray() == distance_dense).all()
+
+    assert group.assign_id(distance_sparse).equals(group.assign_id(distance_dense))
+
+
+def test_multifeature_sparse(sample):
+
+    distance_radians = calculate.distance_matrix(sample['data'], 'Latitude', 'Longitude')
+    distance_dense = group.compare_distance(distance_radians, sample['units']['distance'], sample['thresholds']['distance'])
+
+    max_radians = convert.distance_to_radians(sample['thresholds']['distance'], sample['units']['distance'])
+    distance_graph = calculate.distance_graph(sample['data'], 'Latitude', 'Longitude', max_radians)
+    distance_sparse = group.compare_distance(distance_graph, sample['units']['distance'], sample['thresholds']['distance'])
+
+    duration_seconds = calculate.duration_matrix(sample['data'], 'Pickup Time')
+    time_criteria = group.compare_time(duration_seconds, sample['units']['time'], sample['thresholds']['time'])
+
+    cluster_dense = group.assign_id([distance_dense, time_criteria])
+    cluster_sparse = group.assign_id([distance_sparse, time_criteria])
+
+    assert cluster_sparse.equals(cluster_dense)
+
+
+def test_time_sparse(sample):
+
+    df = sample['data'].sort_values('Pickup Time')
+
+    duration_seconds = calculate.duration_matrix(df, 'Pickup Time')
+    time_dense = group.compare_time(duration_seconds, sample['units']['time'], sample['thresholds']['time'])
+
+    max_seconds = convert.time_to_seconds(sample['thresholds']['time'], sample['units']['time'])
+    duration_graph = calculate.duration_graph(df, 'Pickup Time', max_seconds)
+    time_sparse = group.compare_time(duration_graph, sample['units']['time'], sample['thresholds']['time'])
+
+    assert (time_sparse.toarray() == time_dense).all()
+    assert group.assign_time_id(time_sparse).equals(group.assign_id(time_dense))
+
+    with pytest.raises(RuntimeError):
+        calculate.duration_graph(sample['data'], 'Pickup Time', max_seconds)
+
+
+def test_linkage(sample):
+
+    df = sample['data'].reset_index()
+
+    distance_radians = calculate.distance_matrix(df, 'Latitude', 'Longitude')
+    duration_seconds = calculate.duration_matrix(df, 'Pickup Time')
+
+    max_radians = convert.distance_to_radians(1, sample['units']['distance'])
+    max_seconds = convert.time_to_seconds(30, sample['units']['time'])
+    linkage = group.get_linkage(df, 'Latitude', 'Longitude', 'Pickup Time', max_radians, max_seconds)
+
+    id_columns = ['Location ID', 'Time ID', 'Cluster ID']
+    for distance_threshold, time_threshold in [(0.25, 5), (0.1, 2), (0.5, 10), (1, 30), (0, 0)]:
+        expected = group.get_clusters(
+            df.copy(), distance_radians, sample['units']['distance'], distance_threshold,
+            duration_seconds, sample['units']['time'], time_threshold
+        )
+        labels = group.get_linkage_clusters(
+            df.copy(), linkage, sample['units']['distance'], distance_threshold,
+            sample['units']['time'], time_threshold
+        )
+        assert labels[id_columns].equals(expected[id_columns])
+
+    with pytest.raises(RuntimeError):
+        group.get_linkage_clusters(df.copy(), linkage, sample['units']['distance'], 2, sample['units']['time'], 5)
+
+    # cluster edges with headroom reuse the location forest, which limits the distance
+    headroom = group.get_linkage(
+        df, 'Latitude', 'Longitude', 'Pickup Time', max_radians*2, max_seconds*2, max_radians, linkage['location']
+    )
+    assert headroom['location'] is linkage['location']
+    labels = group.get_linkage_clusters(df.copy(), headroom, sample['units']['distance'], 1, sample['units']['time'], 60)
+    expected = group.get_clusters(
+        df.copy(), distance_radians, sample['units']['distance'], 1, duration_seconds, sample['units']['time'], 60
+    )
+    assert labels[id_columns].equals(expected[id_columns])
+    with pytest.raises(RuntimeError):
+        group.get_linkage_clusters(df.copy(), headroom, sample['units']['distance'], 1.5, sample['units']['time'], 5)
+
+
+def test_segments(sample):
+
+    df = sample['data'].sort_values('Pickup Time').reset_index()
+    df['_latitude_mercator'], df['_longitude_mercator'] = convert.latlon_to_mercator(df['Latitude'], df['Longitude'])
+
+    distance_radians = calculate.distance_matrix(df, 'Latitude', 'Longitude')
+    duration_seconds = calculate.duration_matrix(df, 'Pickup Time')
+
+    arguments = (
+        distance_radians, sample['units']['distance'], sample['thresholds']['distance'],
+        duration_seconds, sample['units']['time'], sample['thresholds']['time']
+    )
+    expected = group.get_clusters(df.copy(), *arguments)
+    labels = group.get_clusters(df.copy(), *arguments, workers=2)
+    assert labels.equals(expected)
+
+
+def test_location_tiles(sample):
+
+    distance_radians = calculate.distance_matrix(sample['data'], 'Latitude', 'Longitude')
+    distance_criteria = group.compare_distance(distance_radians, sample['units']['distance'], sample['thresholds']['distance'])
+    expected = group.assign_id(distance_criteria)
+
+    location_id = group.get_location_id(
+        sample['data'], 'Latitude', 'Longitude', sample['units']['distance'], sample['thresholds']['distance'], workers=2
+    )
+
+    assert location_id.equals(expected)
+
+
+def test_nearest_point(sample):
+
+    distance_radians = calculate.distance_matrix(sample['data'], 'Latitude', 'Longitude')
+    distance_tree = calculate.distance_tree(sample['data'], 'Latitude', 'Longitude')
+
+    for units in ['miles', 'feet', 'kilometers']:
+        expected = calculate.nearest_point(distance_radians, units)
+        nearest = calculate.nearest_point(distance_tree, units)
+        assert np.allclose(nearest, expected)
+
+
+def test_summary_index(sample):
+
+    df = sample['data'].sort_values('Pickup Time').reset_index()
+    df['_latitude_mercator'], df['_longitude_mercator'] = convert.latlon_to_mercator(df['Latitude'], df['Longitude'])
+
+    distance_radians = calculate.distance_matrix(df, 'Latitude', 'Longitude')
+    duration_seconds = calculate.duration_matrix(df, 'Pickup Time')
+    distance_tree = calculate.distance_tree(df, 'Latitude', 'Longitude')
+    units_distance, units_time = sample['units']['distance'], sample['units']['time']
+
+    df = group.get_clusters(
+        df, distance_radians, units_distance, sample['thresholds']['distance'],
+        duration_seconds, units_time, sample['thresholds']['time']
+    )
+
+    expected, _, _ = summary.get_cluster_summary(df.copy(), distance_radians, units_distance, duration_seconds, units_time, 'Pickup Time')
+    cluster_summary, _, _ = summary.get_cluster_summary(df.copy(), distance_tree, units_distance, df['Pickup Time'], units_time, 'Pickup Time')
+    pd.testing.assert_frame_equal(cluster_summary, expected)
+
+    expected = summary.get_location_summary(df, distance_radians, units_distance)
+    location_summary = summary.get_location_summary(df, distance_tree, units_distance)
+    pd.testing.assert_frame_equal(location_summary, expected)
+
+    expected = summary.get_time_summary(df, duration_seconds, units_time)
+    time_summary = summary.get_time_summary(df, df['Pickup Time'], units_time)
+    pd.testing.assert_frame_equal(time_summary, expected)
+
+
+def test_nearest_large_groups(monkeypatch):
+
+    df, _ = synthetic.generate(3000, seed=5)
+    units_distance = 'miles'
+    max_radians = convert.distance_to_radians(0.25, units_distance)
+    df = group.get_clusters(
+        df, calculate.distance_graph(df, 'Latitude', 'Longitude', max_radians), units_distance, 0.25,
+        calculate.duration_graph(df, 'Pickup Time', convert.time_to_seconds(5, 'minutes')), 'minutes', 5
+    )
+    distance_radians = calculate.distance_matrix(df, 'Latitude', 'Longitude')
+    distance_tree = calculate.distance_tree(df, 'Latitude', 'Longitude')
+    id_columns = ['Location ID', 'Cluster ID']
+    groups = [summary.group_index(df, id_column) for id_column in id_columns]
+
+    # count the trees built for the large groups
+    built = []
+    class counted(summary.KDTree):
+        def __init__(self, *args, **kwargs):
+            built.append(len(args[0]))
+            super().__init__(*args, **kwargs)
+    monkeypatch.setattr(summary, 'KDTree', counted)
+
+    nearest = summary.index_next_cluster_nearest('distance', distance_tree, units_distance, groups, 'Nearest', max_neighbors=4)
+    for id_groups, id_nearest in zip(groups, nearest):
+        expected = summary.find_next_cluster_nearest('distance', distance_radians, units_distance, id_groups, 'Nearest')
+        assert np.allclose(id_nearest, expected, equal_nan=True)
+
+    # trees scale with the bits of the number of large groups rather than the number of groups
+    trees = 0
+    for id_groups in groups:
+        large = (np.diff(id_groups['offset']) > 4).sum()
+        assert large > 8
+        trees += 1 + 2*int(large).bit_length()
+    assert len(built) <= trees
+
+
+def test_features_neighbors():
+
+    df, _ = synthetic.generate(3000, seed=6, max_group=40)
+    max_radians = convert.distance_to_radians(0.25, 'miles')
+    df = group.get_clusters(
+        df, calculate.distance_graph(df, 'Latitude', 'Longitude', max_radians), 'miles', 0.25,
+        calculate.duration_graph(df, 'Pickup Time', convert.time_to_seconds(5, 'minutes')), 'minutes', 5
+    )
+    distance_tree = calculate.distance_tree(df, 'Latitude', 'Longitude')
+    neighbors = calculate.nearest_neighbors(distance_tree, 4)
+
+    expected = summary.get_features(df, distance_tree, 'miles', df['Pickup Time'], 'minutes')
+    features = summary.get_features(df, distance_tree, 'miles', df['Pickup Time'], 'minutes', neighbors=neighbors)
+    for id_column in expected:
+        pd.testing.assert_frame_equal(features[id_column], expected[id_column])
+
+    location_summary = summary.get_location_summary(df, distance_tree, 'miles', features=features)
+    clusters = df[df['Location ID']>=0].groupby('Location ID')['Cluster ID'].agg(aggregations.UniqueCountAssigned)
+    assert location_summary['# Clusters'].equals(clusters.rename('# Clusters'))
+
+
+def test_cluster_boundary():
+
+    df, _ = synthetic.generate(3000, seed=7, max_group=100)
+    df['_latitude_mercator'], df['_longitude_mercator'] = convert.latlon_to_mercator(df['Latitude'], df['Longitude'])
+    df['Cluster ID'] = group._rank_labels(np.arange(len(df)) // 7 % 400).values
+    # collinear and duplicate points, in groups above and below the hull size
+    for large, small in [(0, 100), (1, 101)]:
+        assert (df['Cluster ID']==large).sum() > 8 and (df['Cluster ID']==small).sum() <= 8
+    df.loc[df['Cluster ID'].isin([0, 100]), '_latitude_mercator'] = 0
+    df.loc[df['Cluster ID'].isin([1, 101]), ['_latitude_mercator', '_longitude_mercator']] = 1
+
+    cluster_boundary = summary.find_cluster_boundary(df, hull_size=8)
+
+    groups = summary.group_index(df, 'Cluster ID')
+    points = df[['_latitude_mercator', '_longitude_mercator']].to_numpy()[groups['order']]
+    for index, (start, end) in enumerate(zip(groups['offset'][:-1], groups['offset'][1:])):
+        expected = summary.find_location_boundary(points[start:end])
+        boundary = np.column_stack([cluster_boundary.iloc[index, 0][0][0], cluster_boundary.iloc[index, 1][0][0]])
+        # the same vertices in the same order, from any first vertex
+        if len(expected) > 2 and not np.array_equal(expected[0], expected[-1]):
+            assert np.array_equal(boundary, expected)
+        elif len(expected) > 2:
+            shift = np.flatnonzero((expected[:-1]==boundary[0]).all(axis=1))[0]
+            assert np.array_equal(np.roll(expected[:-1], -shift, axis=0), boundary[:-1])
+        else:
+            assert np.array_equal(boundary, expected)
+
+
+def test_features_fused(sample):
+
+    df = sample['data'].sort_values('Pickup Time').reset_index()
+    df['_latitude_mercator'], df['_longitude_mercator'] = convert.latlon_to_mercator(df['Latitude'], df['Longitude'])
+
+    distance_tree = calculate.distance_tree(df, 'Latitude', 'Longitude')
+    units_distance, units_time = sample['units']['distance'], sample['units']['time']
+    linkage = group.get_linkage(
+        df, 'Latitude', 'Longitude', 'Pickup Time',
+        convert.distance_to_radians(sample['thresholds']['distance'], units_distance),
+        convert.time_to_seconds(sample['thresholds']['time'], units_time)
+    )
+    df = group.get_linkage_clusters(
+        df, linkage, units_distance, sample['thresholds']['distance'], units_time, sample['thresholds']['time']
+    )
+
+    features = summary.get_features(df, distance_tree, units_distance, df['Pickup Time'], units_time)
+
+    pd.testing.assert_frame_equal(
+        summary.get_location_summary(df, distance_tree, units_distance, features=features),
+        summary.get_location_summary(df, distance_tree, units_distance)
+    )
+    pd.testing.assert_frame_equal(
+        summary.get_time_summary(df, df['Pickup Time'], units_time, features=features),
+        summary.get_time_summary(df, df['Pickup Time'], units_time)
+    )
+    pd.testing.assert_frame_equal(
+        summary.get_cluster_summary(df.copy(), distance_tree, units_distance, df['Pickup Time'], units_time, 'Pickup Time', features=features)[0],
+        summary.get_cluster_summary(df.copy(), distance_tree, units_distance, df['Pickup Time'], units_time, 'Pickup Time')[0]
+    )
+
+
+def test_blocked(sample):
+
+    df = sample['data'].sort_values('Pickup Time').reset_index()
+    df['_latitude_mercator'], df['_longitude_mercator'] = convert.latlon_to_mercator(df['Latitude'], df['Longitude'])
+    units_distance, units_time = sample['units']['distance'], sample['units']['time']
+
+    distance_radians = calculate.distance_matrix(df, 'Latitude', 'Longitude')
+    duration_seconds = calculate.duration_matrix(df, 'Pickup Time')
+
+    # a budget of a few rows per block
+    distance_blocked = calculate.distance_matrix(df, 'Latitude', 'Longitude', memory_budget=3*len(df)*8*4)
+    duration_blocked = calculate.duration_matrix(df, 'Pickup Time', memory_budget=3*len(df)*8*4)
+    assert distance_blocked.dtype == np.float32
+    assert np.allclose(distance_blocked, np.array(distance_radians), rtol=1e-6, atol=0)
+    assert np.allclose(duration_blocked, np.array(duration_seconds), rtol=1e-6, atol=0)
+
+    arguments = (sample['thresholds']['distance'], sample['thresholds']['time'])
+    expected = group.get_clusters(df.copy(), distance_radians, units_distance, arguments[0], duration_seconds, units_time, arguments[1])
+    labels = group.get_clusters(df.copy(), distance_blocked, units_distance, arguments[0], duration_blocked, units_time, arguments[1], memory_budget=3*len(df)*8*4)
+    assert labels.equals(expected)
+
+    expected = summary.get_features(labels, distance_radians, units_distance, duration_seconds, units_time)
+    features = summary.get_features(labels, distance_blocked, units_distance, duration_blocked, units_time, memory_budget=3*len(df)*8*4)
+    for id_column in expected:
+        pd.testing.assert_frame_equal(features[id_column], expected[id_column])
+
+
+def test_blocked_memory():
+
+    df, labels = synthetic.generate(4000, seed=3)
+    memory_budget = 2**20
+
+    # the peak of each stage excludes the scratch files, which are memory mapped
+    tracemalloc.start()
+    try:
+        distance_blocked = calculate.distance_matrix(df, 'Latitude', 'Longitude', memory_budget)
+        _, peak = tracemalloc.get_traced_memory()
+        assert peak < memory_budget
+        tracemalloc.reset_peak()
+        duration_blocked = calculate.duration_matrix(df, 'Pickup Time', memory_budget)
+        _, peak = tracemalloc.get_traced_memory()
+        assert peak < memory_budget
+        tracemalloc.reset_peak()
+        df = group.get_clusters(
+            df, distance_blocked, 'miles', 0.25, duration_blocked, 'minutes', 5, memory_budget=memory_budget
+        )
+        _, peak = tracemalloc.get_traced_memory()
+        assert peak < memory_budget
+    finally:
+        tracemalloc.stop()
+
+    id_columns = ['Location ID', 'Time ID', 'Cluster ID']
+    assert df[id_columns].equals(labels[id_columns])
@@ -1,8 +1,12 @@
+import base64
+
+import pandas as pd
 import pytest
 
 from bokeh.plotting import show
 
 from clustering_dashboard.dashboard import dashboard
+from clustering_dashboard import synthetic
 
 import data
 
@@ -22,7 +26,9 @@ def sample_10records(request):
     db.column_options['latitude'].value = 'Latitude'
     db.column_options['longitude'].value = 'Longitude'
     db.column_options['time'].value = 'Pickup Time'
-    db._columns_selected(None, None, None)
+    # details picked after the mapped columns are still loaded
+    db.detail_options.value = ['Fare Amount']
+    db._columns_confirmed(None)
 
     db.units['distance'].value = 'miles'
     db.units['time'].value = 'minutes'
@@ -34,19 +40,21 @@ def sample_10records(request):
 
 
 @pytest.fixture(scope='module')
-def sample_allrecords(request):
+def sample_allrecords(request, tmp_path_factory):
 
     file_name = request.param
 
+    path, _ = synthetic.write(tmp_path_factory.mktemp('synthetic') / 'records.parquet', 100000, seed=0)
+
     db = dashboard(f"tests/output/{file_name}.html")
 
-    db._load_data("C:/Users/jacoo/Desktop/Temp/CabData.parquet")
+    db._load_data(str(path))
 
     db.column_options['id'].value = 'TripID'
     db.column_options['latitude'].value = 'Latitude'
     db.column_options['longitude'].value = 'Longitude'
     db.column_options['time'].value = 'Pickup Time'
-    db._columns_selected(None, None, None)
+    db._columns_confirmed(None)
 
     db.units['distance'].value = 'miles'
     db.units['time'].value = 'minutes'
@@ -65,6 +73,155 @@ def test_generate_dashboard(sample_10records):
     show(sample.layout_dashboard)
 
 
+@pytest.mark.parametrize('sample_10records', [('test_projected_columns')], indirect=True)
+def test_projected_columns(sample_10records):
+
+    sample = sample_10records
+
+    assert sample.column_options['id'].options == ['', 'ClusterID_Label', 'Latitude', 'Longitude', 'Pickup Time', 'Fare Amount', 'TripID']
+    assert 'ClusterID_Label' not in sample.details.columns
+    assert 'Fare Amount' in sample.details.columns
+
+
+@pytest.mark.parametrize('sample_10records', [('test_decode_upload')], indirect=True)
+def test_decode_upload(sample_10records):
+
+    sample = sample_10records
+
+    content = bytes(range(256))*100
+    payload = base64.b64encode(content).decode()
+
+    sample.upload_chunk = 400
+    buffer = sample._decode_upload(payload)
+    del sample.upload_chunk
+
+    assert buffer.read() == content
+
+
+@pytest.mark.parametrize('source_format', ['parquet', 'csv'])
+def test_file_selected(tmp_path, source_format):
+
+    path = tmp_path / f'records.{source_format}'
+    getattr(data.df, f'to_{source_format}')(path)
+
+    # the file name isn't set when the contents arrive
+    db = dashboard(f"tests/output/test_file_selected.html")
+    db._file_selected('value', None, base64.b64encode(path.read_bytes()).decode())
+
+    assert db.source_format == source_format
+    assert 'Fare Amount' in db.detail_options.options
+
+    # each upload and the end of the session close the previous upload
+    previous = db.source
+    db._file_selected('value', None, base64.b64encode(path.read_bytes()).decode())
+    assert previous.closed and not db.source.closed
+    previous = db.source
+    db._session_destroyed(None)
+    assert previous.closed and db.source is None
+
+
+def test_columns_selected(tmp_path):
+
+    path = tmp_path / 'records.parquet'
+    data.df.to_parquet(path)
+
+    db = dashboard(f"tests/output/test_columns_selected.html")
+    db._load_data(str(path))
+
+    for column, name in {'id': 'TripID', 'latitude': 'Latitude', 'longitude': 'Longitude'}.items():
+        db.column_options[column].value = name
+        assert db.load_columns.disabled
+    db.column_options['time'].value = 'Pickup Time'
+
+    assert not db.load_columns.disabled
+    assert not hasattr(db, 'details')
+
+
+@pytest.mark.parametrize('sample_10records', [('test_units_selected')], indirect=True)
+def test_units_selected(sample_10records, monkeypatch):
+
+    sample = sample_10records
+    cluster_id = sample.details['Cluster ID'].copy()
+    distance = pd.Series(sample.source_summary.data['Distance (miles)'])
+
+    # changing units only converts the display
+    monkeypatch.setattr(sample, 'cluster', None)
+    sample.units['distance'].value = 'feet'
+    sample.units['time'].value = 'hours'
+
+    assert sample.parameters['cluster_distance'].value == pytest.approx(0.25*5280)
+    assert sample.parameters['cluster_time'].value == pytest.approx(5/60)
+    assert sample.details['Cluster ID'].equals(cluster_id)
+    assert pd.Series(sample.source_summary.data['Distance (feet)']).equals(distance*5280)
+    assert 'Duration (hours)' in sample.source_summary.data
+
+
+class document_stub():
+    '''Collects callbacks that a server document would run on the next tick.'''
+
+    def __init__(self):
+
+        self.callbacks = []
+
+    def add_next_tick_callback(self, callback):
+
+        self.callbacks.append(callback)
+
+
+@pytest.mark.parametrize('sample_10records', [('test_background_clustering')], indirect=True)
+def test_background_clustering(sample_10records):
+
+    sample = sample_10records
+    expected = sample.cluster_result(sample.details, 'miles', 0.5, 'minutes', 10)
+
+    sample.document = document_stub()
+    sample.parameters['cluster_distance'].value = 1
+    sample.parameters['cluster_time'].value = 10
+    sample.parameters['cluster_distance'].value = 0.5
+    assert sample.options['status'].text == 'Clustering...'
+
+    sample.executor.shutdown(wait=True)
+    for callback in sample.document.callbacks:
+        callback()
+
+    # only the latest thresholds are applied
+    assert sample.options['status'].text == ''
+    assert sample.cluster_summary.equals(expected['cluster_summary'])
+    assert (sample.details['Cluster ID'].to_numpy() == expected['details']['Cluster ID']).all()
+
+
+@pytest.mark.parametrize('sample_10records', [('test_diagnostics')], indirect=True)
+def test_diagnostics(sample_10records):
+
+    sample = sample_10records
+
+    sample.update_diagnostics()
+
+    spans = sample.source_diagnostics.data['span']
+    assert 'selections.reset_all' in spans
+    assert 'selections.reset_all/engine.cluster_result/summary.get_features' in spans
+
+
+@pytest.mark.parametrize('sample_10records', [('test_profiling')], indirect=True)
+def test_profiling(sample_10records, tmp_path):
+
+    sample = sample_10records
+
+    sample.profile_directory = tmp_path
+    sample.profile_memory = True
+    sample.options['profiling'].active = True
+    try:
+        sample.reset_all()
+    finally:
+        sample.options['profiling'].active = False
+
+    # callbacks nested in reset_all aren't profiled separately
+    profiles = sorted(path.suffix for path in tmp_path.iterdir())
+    assert profiles == ['.prof', '.txt']
+    summary = next(tmp_path.glob('*.txt')).read_text()
+    assert 'selections.py' in summary and 'Peak traced memory' in summary
+
+
 @pytest.mark.parametrize('sample_10records', [('test_crossfilter_sliders')], indirect=True)
 def test_crossfilter_sliders(sample_10records):
     
@@ -90,6 +247,29 @@ def test_crossfilter_tables(sample_10records):
     show(sample.layout_dashboard)
 
 
+@pytest.mark.parametrize('sample_10records', [('test_crossfilter_index')], indirect=True)
+def test_crossfilter_index(sample_10records):
+
+    sample = sample_10records
+    details = sample.details
+    location = sample.location_summary.index[0]
+
+    sample.source_location.selected.indices = [0]
+
+    # same records and ids as scanning the details
+    selected = details['Location ID']==location
+    assert sample.selected_details.equals(details[selected])
+    time = details.loc[selected & (details['Time ID']>=0), 'Time ID'].unique()
+    assert sorted(sample.source_time.data['Time ID']) == sorted(time)
+    cluster = details.loc[selected & (details['Cluster ID']>=0), 'Cluster ID'].unique()
+    assert sorted(sample.source_summary.data['Cluster ID']) == sorted(cluster)
+
+    # only the highlight of the location table changes
+    sample.source_location.selected.indices = [1]
+    assert list(sample.source_location.data['_selected_color'][:2]) == ['null', '#ee4729']
+    assert sample.selected_details.equals(details[details['Location ID']==sample.location_summary.index[1]])
+
+
 @pytest.mark.parametrize('sample_allrecords', [('test_large_file')], indirect=True)
 def test_large_file(sample_allrecords):
 
@@ -0,0 +1,128 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from clustering_dashboard import convert, group, cache, crossfilter, synthetic
+from clustering_dashboard.engine import engine
+
+import data
+
+
+def prepare_reference(details, columns):
+    '''Derived columns as calculated row by row.'''
+
+    details = details.copy()
+    details[['Cluster ID', 'Location ID', 'Time ID']] = None
+    details[columns['time']] = pd.to_datetime(details[columns['time']])
+    details = details.sort_values(by=columns['time'], kind='stable')
+    if details.index.name == columns['id']:
+        details = details.reset_index()
+    details['_timestamp'] = details[columns['time']].apply(lambda x: int(x.timestamp()*1000))
+    latitude_mercator, longitude_mercator = convert.latlon_to_mercator(details[columns['latitude']], details[columns['longitude']])
+    details['_latitude_mercator'] = latitude_mercator
+    details['_longitude_mercator'] = longitude_mercator
+
+    return details
+
+
+@pytest.mark.parametrize('time', [
+    data.df['Pickup Time'],
+    data.df['Pickup Time'].astype(str),
+    data.df['Pickup Time'].dt.tz_localize('US/Eastern'),
+    data.df['Pickup Time'] - pd.Timestamp('2010-01-27 15:30:00') + pd.Timestamp('1969-12-31 23:59:59.5005')
+])
+def test_prepare_details(time):
+
+    columns = pd.Series({'id': 'TripID', 'latitude': 'Latitude', 'longitude': 'Longitude', 'time': 'Pickup Time'})
+    details = data.df.assign(**{'Pickup Time': time})
+
+    model = engine()
+    model.columns = columns
+    model.details = details.copy()
+    model._prepare_details()
+
+    expected = prepare_reference(details, columns)
+    id_columns = ['Cluster ID', 'Location ID', 'Time ID']
+    assert (model.details[id_columns] == -1).all().all()
+    assert (model.details[id_columns].dtypes == 'int32').all()
+    assert model.details.drop(columns=id_columns).equals(expected.drop(columns=id_columns))
+
+
+def test_prepare_details_float32():
+
+    columns = pd.Series({'id': 'TripID', 'latitude': 'Latitude', 'longitude': 'Longitude', 'time': 'Pickup Time'})
+
+    model = engine()
+    model.mercator_dtype = np.float32
+    model.columns = columns
+    model.details = data.df.copy()
+    model._prepare_details()
+
+    expected = prepare_reference(data.df, columns)
+    for col in ['_latitude_mercator', '_longitude_mercator']:
+        assert model.details[col].dtype == np.float32
+        assert np.allclose(model.details[col], expected[col], rtol=1e-6)
+
+
+def test_cluster_cache(monkeypatch):
+
+    model = engine()
+    model.columns = pd.Series({'id': 'TripID', 'latitude': 'Latitude', 'longitude': 'Longitude', 'time': 'Pickup Time'})
+    model.details = data.df.copy()
+    model._prepare_details()
+
+    model.cluster('miles', 0.25, 'minutes', 5)
+    expected = model.details.copy(), model.cluster_summary.copy(), model.location_summary.copy()
+    model.cluster('miles', 0.5, 'minutes', 10)
+
+    # revisiting thresholds restores the cached result without labeling
+    monkeypatch.setattr(group, 'get_linkage_clusters', None)
+    model.cluster('miles', 0.25, 'minutes', 5)
+
+    assert model.details.equals(expected[0])
+    assert model.cluster_summary.equals(expected[1])
+    assert model.location_summary.equals(expected[2])
+
+
+def test_result_cache():
+
+    results = cache.result_cache(max_bytes=250)
+    for key in range(3):
+        results.put(key, {'ids': np.zeros(10)})
+    results.get(0)
+    results.put(3, {'ids': np.zeros(10)})
+
+    assert list(results.entries.keys()) == [2, 0, 3]
+    assert results.nbytes == 240
+
+    # results larger than the cap aren't cached
+    results.put(4, {'ids': np.zeros(100)})
+    assert results.get(4) is None
+
+
+def test_result_bytes():
+
+    boundary = pd.DataFrame({'_latitude_mercator': [[[list(np.arange(100.0))]]]*3})
+    shallow = int(boundary.memory_usage(deep=True).sum())
+    assert cache.result_bytes(boundary) > shallow + 3*100*8
+
+    index = crossfilter.id_index(pd.DataFrame({'Location ID': [0, 0, 1], 'Time ID': [-1, 0, 0], 'Cluster ID': [-1, 0, -1]}))
+    matrix = index['rows']['Location ID']
+    assert cache.result_bytes(index) >= matrix.data.nbytes + matrix.indices.nbytes + matrix.indptr.nbytes
+
+
+def test_id_index():
+
+    _, labels = synthetic.generate(2000, seed=5)
+    index = crossfilter.id_index(labels)
+
+    for column in ['Location ID', 'Time ID', 'Cluster ID']:
+        ids = labels.loc[labels[column]>=0, column].drop_duplicates().iloc[:3]
+        selected = labels[column].isin(ids)
+        assert (crossfilter.id_rows(index, column, ids) == np.flatnonzero(selected)).all()
+        for other in ['Location ID', 'Time ID', 'Cluster ID']:
+            if other != column:
+                expected = np.unique(labels.loc[selected & (labels[other]>=0), other])
+                assert (crossfilter.shared_ids(index, column, ids, other) == expected).all()
+
+    assert len(crossfilter.id_rows(index, 'Location ID', [])) == 0
@@ -0,0 +1,34 @@
+import json
+
+import numpy as np
+
+from clustering_dashboard import performance
+
+
+@performance.timing
+def stage(size):
+    return np.zeros(size)
+
+
+def test_spans():
+
+    metrics = performance.registry()
+    performance.metrics, previous = metrics, performance.metrics
+
+    try:
+        with performance.span('callback') as measured:
+            stage(10)
+            stage(20)
+            measured['rows'] = 30
+    finally:
+        performance.metrics = previous
+
+    summary = json.loads(metrics.to_json())
+
+    assert set(summary.keys()) == {'callback', 'callback/test_performance.stage'}
+    assert summary['callback/test_performance.stage']['count'] == 2
+    assert summary['callback/test_performance.stage']['rows'] == 30
+    assert summary['callback/test_performance.stage']['bytes'] == 30*8
+    assert summary['callback']['rows'] == 30
+    assert summary['callback']['total'] >= summary['callback/test_performance.stage']['total']
+    assert summary['callback']['p50'] <= summary['callback']['p99'] <= summary['callback']['max']
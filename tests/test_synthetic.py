@@ -0,0 +1,94 @@
+import pandas as pd
+import pyarrow.parquet as pq
+import pytest
+
+from clustering_dashboard import calculate, convert, group, synthetic
+from clustering_dashboard.engine import engine
+
+
+@pytest.fixture(scope='module')
+def generated():
+
+    records, labels = synthetic.generate(5000, seed=1)
+
+    yield {'records': records, 'labels': labels}
+
+
+def test_generate_clusters(generated):
+
+    df = generated['records']
+    max_radians = convert.distance_to_radians(0.25, 'miles')
+    max_seconds = convert.time_to_seconds(5, 'minutes')
+    id_columns = ['Location ID', 'Time ID', 'Cluster ID']
+
+    distance_radians = calculate.distance_graph(df, 'Latitude', 'Longitude', max_radians)
+    duration_seconds = calculate.duration_graph(df, 'Pickup Time', max_seconds)
+    for workers in [None, 2]:
+        labeled = group.get_clusters(df.copy(), distance_radians, 'miles', 0.25, duration_seconds, 'minutes', 5, workers)
+        assert labeled[id_columns].equals(generated['labels'][id_columns])
+        for tiled in [False, True]:
+            labeled = group.get_clusters(
+                df.copy(), None if tiled else distance_radians, 'miles', 0.25, duration_seconds, 'minutes', 5, workers,
+                coordinate_columns=['Latitude', 'Longitude'], tiled=tiled
+            )
+            assert labeled[id_columns].equals(generated['labels'][id_columns])
+
+    linkage = group.get_linkage(df, 'Latitude', 'Longitude', 'Pickup Time', max_radians*2, max_seconds*2)
+    labeled = group.get_linkage_clusters(df.copy(), linkage, 'miles', 0.25, 'minutes', 5)
+    assert labeled[id_columns].equals(generated['labels'][id_columns])
+
+
+def test_clusters_unsorted():
+
+    records, _ = synthetic.generate(1500, seed=2)
+    df = records.sample(frac=1, random_state=0).reset_index(drop=True)
+    assert not df['Pickup Time'].is_monotonic_increasing
+
+    distance_radians = calculate.distance_matrix(df, 'Latitude', 'Longitude')
+    duration_seconds = calculate.duration_matrix(df, 'Pickup Time')
+    arguments = (distance_radians, 'miles', 0.25, duration_seconds, 'minutes', 5)
+    expected = group.get_clusters(df.copy(), *arguments)
+    labeled = group.get_clusters(df.copy(), *arguments, workers=2)
+    assert labeled.equals(expected)
+
+    with pytest.raises(RuntimeError):
+        group.time_segments(expected['Time ID'], 2)
+
+
+def test_generate_kinds(generated):
+
+    records, labels = generated['records'], generated['labels']
+
+    assert records['Pickup Time'].is_monotonic_increasing
+    assert (labels.loc[records['Kind']=='noise', ['Location ID', 'Time ID', 'Cluster ID']] == -1).all().all()
+    assert (labels.loc[records['Kind']=='joint', 'Cluster ID'] >= 0).all()
+    assert (labels.loc[records['Kind']=='location', ['Time ID', 'Cluster ID']] == -1).all().all()
+    assert (labels.loc[records['Kind']=='time', ['Location ID', 'Cluster ID']] == -1).all().all()
+    # diurnal gaps
+    assert records['Pickup Time'].dt.hour.between(6, 21).all()
+    assert records.duplicated(['Latitude', 'Longitude']).any()
+
+
+def test_generate_seed():
+
+    first, _ = synthetic.generate(100, seed=2)
+    second, _ = synthetic.generate(100, seed=2)
+    third, _ = synthetic.generate(100, seed=3)
+
+    assert first.equals(second)
+    assert not first.equals(third)
+
+
+def test_write_cluster(tmp_path):
+
+    path, path_labels = synthetic.write(tmp_path / 'records.parquet', 2000, row_group_size=500, seed=4, duplicate_fraction=0.5)
+
+    assert pq.ParquetFile(path).num_row_groups == 4
+
+    model = engine()
+    model.load_details(path, {'id': 'TripID', 'latitude': 'Latitude', 'longitude': 'Longitude', 'time': 'Pickup Time'})
+    model.cluster('miles', 0.25, 'minutes', 5, linkage=False)
+
+    labels = pd.read_parquet(path_labels)
+    for column in ['Location ID', 'Time ID', 'Cluster ID']:
+        assert (model.details[column].values == labels[column].values).all()